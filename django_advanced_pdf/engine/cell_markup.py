@@ -0,0 +1,156 @@
+import re
+
+# a line break that a long cell can be split at
+BREAK_PATTERN = re.compile(rb'<br\s?/>')
+# tags when splitting at line breaks
+TAG_PATTERN = re.compile(rb'<[^<>]*>')
+# tags when splitting by length
+LENGTH_TAG_PATTERN = re.compile(rb'</?(\w+)[^<>]*?>')
+TAG_NAME_PATTERN = re.compile(r'\w+')
+
+
+def split_cell_markup(xml, overflow_length, overflow_size):
+    """
+    Splits the markup of a cell into rows, each of which is valid markup on its own as the tags open at the end of a
+    row are closed and then opened again at the start of the next.
+    If there's a line break after the first overflow_length characters the cell is split at every line break from
+    there on, otherwise it's split into pieces of about overflow_length characters (overflow_size if that's 0) at
+    spaces or between tags.
+    The markup is only read through once, keeping track of which tags are open as it goes.
+    @type   xml : bytes
+    @param  xml : cell markup, including the td tag
+    @return : (first row, remaining rows, each row without the tags added to it, the tags open for each row (after it
+               when split at line breaks, before it when split by length), whether it was split by length)
+    """
+    offset = xml.find(b'>')
+    match = BREAK_PATTERN.search(xml, overflow_length + offset)
+    if match:
+        rows, raw_parts, held_tags = split_at_breaks(xml, match.start())
+        return rows[0], rows[1:], raw_parts, held_tags, False
+    if overflow_length == 0:
+        overflow_length = overflow_size
+    rows, raw_parts, held_tags = split_by_length(xml, overflow_length)
+    return rows[0], rows[1:], raw_parts, held_tags, True
+
+
+def close_tags(open_tags):
+    return b''.join(b'</%s>' % tag_name for tag_name, _ in reversed(open_tags))
+
+
+def split_at_breaks(xml, first_break):
+    """
+    Splits the markup at each line break from first_break on.
+    The tags are (name, tag) strings. A closing tag with nothing open, or the closing td of the cell, ends the tags
+    looked at until the next line break.
+    """
+    rows = []
+    raw_parts = []
+    held_tags = []
+    open_tags = []
+    reopen = b''
+    # the open tags as held for each row and the markup closing and reopening them, only worked out again once the
+    # open tags change as most rows of a notes field open and close none
+    row_tags = None
+
+    parts = [xml[:first_break]] + BREAK_PATTERN.split(xml[BREAK_PATTERN.match(xml, first_break).end():])
+    for part in parts:
+        if b'<' in part and update_open_tags(part, open_tags):
+            row_tags = None
+        if row_tags is None:
+            row_tags = (list(open_tags),
+                        close_tags([(tag_name.encode(), tag) for tag_name, tag in open_tags]),
+                        ''.join(tag for _, tag in open_tags).encode())
+        raw_parts.append(part)
+        held_tags.append(row_tags[0])
+        rows.append(reopen + part + row_tags[1])
+        reopen = row_tags[2]
+    return rows, raw_parts, held_tags
+
+
+def update_open_tags(part, open_tags):
+    """
+    Opens and closes the tags in a row's markup, returning True if open_tags changed.
+    """
+    changed = False
+    for match in TAG_PATTERN.finditer(part):
+        tag = match.group(0).decode()
+        if tag[-2] == '/':
+            continue
+        name_match = TAG_NAME_PATTERN.search(tag)
+        if name_match is None:
+            continue
+        tag_name = name_match.group(0)
+        if tag[1] == '/':
+            if not open_tags:
+                break
+            if tag_name == open_tags[-1][0]:
+                open_tags.pop()
+                changed = True
+                if tag_name == 'td' and not open_tags:
+                    break
+        else:
+            open_tags.append((tag_name, tag))
+            changed = True
+    return changed
+
+
+def split_by_length(xml, overflow_length):
+    """
+    Splits the markup into pieces of about overflow_length characters, without splitting a tag.
+    Each piece ends after the last space or tag that fits (or where the length runs out if there are neither). The
+    tags are (name, tag) bytes.
+    """
+    rows = []
+    raw_parts = []
+    held_tags = []
+    open_tags = []
+    tags = LENGTH_TAG_PATTERN.finditer(xml)
+    tag = next(tags, None)
+    length = len(xml)
+    pos = 0
+    while pos < length:
+        end = int(min(pos + overflow_length, length))
+        lt = xml.rfind(b'<', pos, end)
+        gt = xml.rfind(b'>', pos, end)
+        if lt > gt:
+            end = lt
+        else:
+            safe = max(xml.rfind(b' ', pos, end), gt)
+            if safe != -1:
+                end = safe + 1
+        if end == pos:
+            if pos + overflow_length < length:
+                # a tag longer than overflow_length
+                overflow_length += 1
+                continue
+            end = length
+
+        reopen_tags = list(open_tags)
+        while tag is not None and tag.start() < end:
+            full_tag = tag.group()
+            tag_name = tag.group(1)
+            if full_tag.startswith(b'</'):
+                if open_tags and tag_name == open_tags[-1][0]:
+                    open_tags.pop()
+            elif not full_tag.endswith(b'/>'):
+                open_tags.append((tag_name, full_tag))
+            tag = next(tags, None)
+
+        part = xml[pos:end]
+        raw_parts.append(part)
+        held_tags.append(reopen_tags)
+        rows.append(b''.join(tag_text for _, tag_text in reopen_tags) + part + close_tags(open_tags))
+        pos = end
+    return rows, raw_parts, held_tags
+
+
+def markup_prefix(raw_parts, held_tags, count, by_length):
+    """
+    Returns the markup of the first count rows from split_cell_markup as one piece of valid markup (the start of the
+    cell with its open tags closed).
+    """
+    if by_length:
+        open_tags = held_tags[count] if count < len(held_tags) else []
+        return b''.join(raw_parts[:count]) + close_tags(open_tags)
+    return b'<br/>'.join(raw_parts[:count]) + close_tags([(tag_name.encode(), tag)
+                                                          for tag_name, tag in held_tags[count - 1]])
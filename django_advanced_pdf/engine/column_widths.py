@@ -0,0 +1,83 @@
+from django_advanced_pdf.engine.font_metrics import get_font_widths
+
+# tables with more rows than this only have a sample of their rows measured
+AUTO_WIDTH_SAMPLE_ROWS = 200
+# markup that can be in a cell that's measured as text
+AUTO_WIDTH_TEXT_TAGS = ('b', 'i', 'u', 'strong', 'em', 'strike', 'font', 'span', 'super', 'sup', 'sub', 'br', 'a')
+
+
+def sample_rows(rows, sample_size=AUTO_WIDTH_SAMPLE_ROWS):
+    """
+    Returns an evenly spread sample of rows (always including the first, which is often the column headings)
+    """
+    if len(rows) <= sample_size:
+        return rows
+    step = len(rows) / float(sample_size)
+    return [rows[int(index * step)] for index in range(sample_size)]
+
+
+class ColumnMeasure(object):
+    """
+    The minimum (widest word) and preferred (widest line) width of the cells in a column, in points.
+    Text is gathered up by font so each font's words and lines can be measured in one go.
+    """
+
+    def __init__(self):
+        self.minimum = 0
+        self.preferred = 0
+        self.padding = 0
+        self._texts = {}
+
+    def add_cell(self, lines, font_name, font_size, padding):
+        words, full_lines = self._texts.setdefault((font_name, font_size), ([], []))
+        for line in lines:
+            words.extend(line.split())
+            full_lines.append(line)
+        self.padding = max(self.padding, padding)
+
+    def measure(self):
+        for (font_name, font_size), (words, lines) in self._texts.items():
+            font_widths = get_font_widths(font_name)
+            if words:
+                self.minimum = max(self.minimum, max(font_widths.token_widths(words, font_size)))
+            if lines:
+                self.preferred = max(self.preferred, max(font_widths.token_widths(lines, font_size)))
+        self._texts = {}
+        if self.minimum or self.preferred:
+            self.minimum += self.padding
+            self.preferred += self.padding
+        return self.minimum, self.preferred
+
+
+def solve_column_widths(minimum_widths, preferred_widths, available):
+    """
+    Shares out the available width between columns in the same way as an html table with automatic layout.
+    If every column fits at its preferred width the space left over is shared in proportion to the preferred widths.
+    Otherwise each column gets its minimum width plus a share of what's left in proportion to how much wider it would
+    like to be. If even the minimum widths don't fit they're scaled down.
+    @type   minimum_widths : list
+    @param  minimum_widths : widest word in each column (including padding)
+    @type   preferred_widths : list
+    @param  preferred_widths : widest line in each column (including padding)
+    @return : list of widths, adding up to available
+    """
+    columns = len(preferred_widths)
+    if columns == 0:
+        return []
+    total_preferred = sum(preferred_widths)
+    total_minimum = sum(minimum_widths)
+    if total_preferred <= 0:
+        return [available / columns] * columns
+
+    if total_preferred <= available:
+        return [width * available / total_preferred for width in preferred_widths]
+
+    if total_minimum < available:
+        extra = [preferred - minimum for minimum, preferred in zip(minimum_widths, preferred_widths)]
+        total_extra = sum(extra)
+        spare = available - total_minimum
+        return [minimum + spare * e / total_extra for minimum, e in zip(minimum_widths, extra)]
+
+    if total_minimum <= 0:
+        return [available / columns] * columns
+    return [width * available / total_minimum for width in minimum_widths]
@@ -0,0 +1,43 @@
+from reportlab.platypus.flowables import Flowable
+
+from django_advanced_pdf.engine.enhanced_paragraph.enhanced_paragraph import EnhancedParagraph
+
+
+class DeferredParagraph(Flowable):
+    """
+    Table cell that only holds the source of an EnhancedParagraph (its text, style and css classes).
+    The paragraph is built when the cell is measured or drawn and let go straight afterwards, so a long table doesn't
+    keep the parsed text and broken lines of every cell. The measured size is kept for each width the cell has been
+    wrapped to, as reportlab wraps a cell again just before drawing it.
+    """
+
+    _fixedWidth = 0
+
+    def __init__(self, text, style, css_classes=None):
+        Flowable.__init__(self)
+        self.text = text
+        self.style = style
+        self.css_classes = css_classes
+        self._sizes = {}
+
+    def paragraph(self):
+        return EnhancedParagraph(self.text, self.style, css_classes=self.css_classes)
+
+    def wrap(self, availWidth, availHeight):
+        size = self._sizes.get(availWidth)
+        if size is None:
+            size = self._sizes[availWidth] = self.paragraph().wrap(availWidth, availHeight)
+        self.width, self.height = size
+        self._wrap_width = availWidth
+        return size
+
+    def split(self, availWidth, availHeight):
+        return self.paragraph().split(availWidth, availHeight)
+
+    def minWidth(self):
+        return self.paragraph().minWidth()
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        paragraph = self.paragraph()
+        paragraph.wrap(self._wrap_width, self.height)
+        paragraph.drawOn(canvas, x, y, _sW=_sW)
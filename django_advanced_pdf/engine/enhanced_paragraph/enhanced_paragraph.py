@@ -1,21 +1,81 @@
+from copy import deepcopy
+
+from reportlab.pdfbase.pdfmetrics import getAscentDescent
 from reportlab.platypus import Paragraph
-from reportlab.platypus.paragraph import textTransformFrags
+from reportlab.platypus.paragraph import textTransformFrags, split, strip, _processed_frags, _shy, FragLine, \
+    _FUZZ
 
 from django_advanced_pdf.engine.enhanced_paragraph.parser import EnhancedParaParser
+from django_advanced_pdf.engine.font_metrics import break_words, get_font_widths, string_width
+
+
+class HeldLines(object):
+    """
+    A run of lines that have already been broken for a paragraph.
+    All the pieces a paragraph is split into share the original broken lines and just hold a start/stop cursor,
+    so a long paragraph is only broken once however many pages it runs over.
+    """
+
+    def __init__(self, bl_para, start, stop, widths, split_func):
+        self.bl_para = bl_para
+        self.start = start
+        self.stop = stop
+        self.widths = widths
+        self.split_func = split_func
+
+    def piece(self, start, stop):
+        return HeldLines(bl_para=self.bl_para,
+                         start=self.start + start,
+                         stop=self.start + stop,
+                         widths=self.widths,
+                         split_func=self.split_func)
+
+    def matches(self, widths):
+        """
+        Checks that the held lines were broken to the same widths as the ones being asked for now
+        """
+        last_width = len(self.widths) - 1
+        last_new_width = len(widths) - 1
+        for line in range(min(self.stop - self.start, max(len(self.widths), len(widths)) + 1)):
+            if widths[min(line, last_new_width)] != self.widths[min(self.start + line, last_width)]:
+                return False
+        return True
+
+    def get_bl_para(self, widths):
+        if not self.matches(widths):
+            return None
+        return self.bl_para.clone(lines=self.bl_para.lines[self.start:self.stop])
+
+    def frags(self):
+        return self.split_func(self.bl_para, self.start, self.stop)
 
 
 class EnhancedParagraph(Paragraph):
     # bulletText needs to be camelcase as it is referenced internally by the reportlab code and will break if changed
     def __init__(self, text, style, bulletText=None, frags=None, case_sensitive=1,
-                 encoding='utf8', css_classes=None):
+                 encoding='utf8', css_classes=None, incremental_split=False, held_lines=None):
         if css_classes is None:
             self.css_classes = {}
         else:
             self.css_classes = css_classes
+        self.incremental_split = incremental_split
+        self._held_lines = held_lines
+        self._estimated_heights = {}
         Paragraph.__init__(self, text, style, bulletText, frags, case_sensitive, encoding)
 
+    @property
+    def frags(self):
+        # frags for a piece of a split paragraph are only worked out if its held lines can't be used
+        if self._frags is None and self._held_lines is not None:
+            self._frags = self._held_lines.frags()
+        return self._frags
+
+    @frags.setter
+    def frags(self, value):
+        self._frags = value
+
     def _setup(self, text, style, bullet_text, frags, cleaner):
-        if frags is None:
+        if frags is None and self._held_lines is None:
             text = cleaner(text)
             _parser = EnhancedParaParser(self.css_classes)
             _parser.caseSensitive = self.caseSensitive
@@ -34,6 +94,198 @@ class EnhancedParagraph(Paragraph):
         self.bulletText = bullet_text
         self.debug = 0
 
+    def _single_style_words(self):
+        """
+        Returns the words of the paragraph if it is a single style run that break_words can lay out exactly as
+        reportlab would, otherwise None.
+        """
+        style = self.style
+        frags = self.frags
+        if len(frags) != 1 or self.bulletText or style.endDots:
+            return None
+        f = frags[0]
+        if (not hasattr(f, 'text') or hasattr(f, 'cbDefn') or hasattr(f, 'backColor') or
+                _processed_frags(frags)):
+            return None
+        if getattr(style, 'hyphenationLang', '') or style.uriWasteReduce or style.embeddedHyphenation:
+            return None
+        text = strip(f.text)
+        if _shy in text:
+            return None
+        return split(text) if text else []
+
+    def breakLines(self, width):
+        if self._held_lines is not None:
+            bl_para = self._held_lines.get_bl_para(width if isinstance(width, (tuple, list)) else [width])
+            if bl_para is not None:
+                return bl_para
+            self._frags = self._held_lines.frags()
+            self._held_lines = None
+
+        words = self._single_style_words()
+        if words is None:
+            return Paragraph.breakLines(self, width)
+
+        max_widths = list(width) if isinstance(width, (tuple, list)) else [width]
+        f = self.frags[0]
+        font_name = f.fontName
+        font_size = f.fontSize
+        ascent, descent = getAscentDescent(font_name, font_size)
+        self._width_max = 0
+        self._splitLongWordCount = self._hyphenations = 0
+        self.height = 0
+        if not words:
+            return f.clone(kind=0, lines=[], ascent=ascent, descent=descent, fontSize=font_size)
+
+        word_widths = get_font_widths(font_name).token_widths(words, font_size)
+        if self.style.splitLongWords and max(word_widths) > min(max_widths):
+            # long words need splitting across lines, leave that to reportlab
+            return Paragraph.breakLines(self, width)
+
+        lines, self._width_max = break_words(words=words,
+                                             font_name=font_name,
+                                             font_size=font_size,
+                                             max_widths=max_widths,
+                                             space_shrinkage=self.style.spaceShrinkage,
+                                             word_widths=word_widths)
+        return f.clone(kind=0, lines=lines, ascent=ascent, descent=descent, fontSize=font_size)
+
+    def estimate_height(self, avail_width):
+        """
+        Returns the height wrap gives for avail_width.
+        A single style paragraph with a fixed leading has its height worked out from sums of its word widths (the same
+        line breaking break_words does, so the result is exact) rather than being broken into lines. Any other
+        paragraph is wrapped. Either way the height is kept for each width as a table works out its row heights again
+        after every split.
+        """
+        height = self._estimated_heights.get(avail_width)
+        if height is None:
+            height = self._calc_estimated_height(avail_width)
+            if height is None:
+                _, height = self.wrap(avail_width, 0x7fffffff)
+            self._estimated_heights[avail_width] = height
+        return height
+
+    def _calc_estimated_height(self, avail_width):
+        style = self.style
+        auto_leading = getattr(self, 'autoLeading', getattr(style, 'autoLeading', ''))
+        if (avail_width < _FUZZ or self._held_lines is not None or style.wordWrap == 'CJK' or
+                auto_leading not in ('', 'off')):
+            return None
+        words = self._single_style_words()
+        if words is None:
+            return None
+        if not words:
+            return 0
+
+        f = self.frags[0]
+        first_line_width = avail_width - (style.leftIndent + style.firstLineIndent) - style.rightIndent
+        later_widths = avail_width - style.leftIndent - style.rightIndent
+        word_widths = get_font_widths(f.fontName).token_widths(words, f.fontSize)
+        if style.splitLongWords and max(word_widths) > min(first_line_width, later_widths):
+            return None
+        if sum(word_widths) + string_width(' ', f.fontName, f.fontSize) * (len(words) - 1) <= first_line_width:
+            line_count = 1
+        else:
+            lines, _ = break_words(words=words,
+                                   font_name=f.fontName,
+                                   font_size=f.fontSize,
+                                   max_widths=[first_line_width, later_widths],
+                                   space_shrinkage=style.spaceShrinkage,
+                                   word_widths=word_widths)
+            line_count = len(lines)
+        return line_count * style.leading
+
+    def split(self, availWidth, availHeight):
+        if not self.incremental_split or self.bulletText or self.style.endDots:
+            return Paragraph.split(self, availWidth, availHeight)
+        return self.split_held_lines(availWidth, availHeight)
+
+    def split_held_lines(self, avail_width, avail_height):
+        """
+        Modified version of Paragraph.split.
+        Rather than handing the remaining text to a new paragraph (which then has to break all of it again) both
+        pieces hold a slice of the lines that have already been broken.
+        """
+        if avail_width < _FUZZ or avail_height < _FUZZ:
+            return []
+        if self._held_lines is None and len(self.frags) <= 0:
+            return []
+
+        if not hasattr(self, 'blPara'):
+            self.wrap(avail_width, avail_height)
+        bl_para = self.blPara
+        style = self.style
+        auto_leading = getattr(self, 'autoLeading', getattr(style, 'autoLeading', ''))
+        leading = style.leading
+        lines = bl_para.lines
+        if bl_para.kind == 1 and auto_leading not in ('', 'off'):
+            s = height = 0
+            if auto_leading == 'max':
+                for i, l in enumerate(lines):
+                    n = height + max(l.ascent - l.descent, leading)
+                    if n > avail_height + 1e-8:
+                        break
+                    height = n
+                    s = i + 1
+            elif auto_leading == 'min':
+                for i, l in enumerate(lines):
+                    n = height + l.ascent - l.descent
+                    if n > avail_height + 1e-8:
+                        break
+                    height = n
+                    s = i + 1
+            else:
+                raise ValueError('invalid autoLeading value %r' % auto_leading)
+        else:
+            l = leading
+            if auto_leading == 'max':
+                l = max(leading, 1.2 * style.fontSize)
+            elif auto_leading == 'min':
+                l = 1.2 * style.fontSize
+            s = int(avail_height / float(l))
+            height = s * l
+
+        allow_orphans = getattr(self, 'allowOrphans', getattr(style, 'allowOrphans', 0))
+        if (not allow_orphans and s <= 1) or s == 0:
+            del self.blPara
+            return []
+        n = len(lines)
+        allow_widows = getattr(self, 'allowWidows', getattr(style, 'allowWidows', 1))
+        if n <= s:
+            return [self]
+        if not allow_widows:
+            if n == s + 1:
+                if (allow_orphans and n == 3) or n > 3:
+                    s -= 1
+                else:
+                    del self.blPara
+                    return []
+
+        held_lines = self._held_lines
+        if held_lines is None:
+            held_lines = HeldLines(bl_para=bl_para,
+                                   start=0,
+                                   stop=n,
+                                   widths=list(self._wrapWidths),
+                                   split_func=self._get_split_blParaFunc())
+
+        p1 = self.__class__(None, style, css_classes=self.css_classes, incremental_split=True,
+                            held_lines=held_lines.piece(0, s))
+        p1._JustifyLast = not (isinstance(lines[s - 1], FragLine) and
+                               hasattr(lines[s - 1], 'lineBreak') and lines[s - 1].lineBreak)
+        p1._splitpara = 1
+        p1.height = height
+        p1.width = avail_width
+        if style.firstLineIndent != 0:
+            style = deepcopy(style)
+            style.firstLineIndent = 0
+        p2 = self.__class__(None, style, css_classes=self.css_classes, incremental_split=True,
+                            held_lines=held_lines.piece(s, n))
+        if hasattr(self, 'autoLeading'):
+            p1.autoLeading = p2.autoLeading = self.autoLeading
+        return [p1, p2]
+
     def calc_text_height(self, avail_width):
         # work out widths array for breaking
         style = self.style
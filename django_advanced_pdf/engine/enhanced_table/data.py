@@ -1,3 +1,70 @@
+import re
+
+from reportlab.platypus.paragraph import Paragraph
+from reportlab.platypus.tables import CellStyle
+from six import string_types
+
+from django_advanced_pdf.engine.enhanced_table.data_paragraph import DataParagraph
+from django_advanced_pdf.engine.utils import DecimalText
+
+VARIABLE_NAME_RE = re.compile(r'%\(([^)]*)\)')
+
+
+class CompiledRows(object):
+    """
+    The rows of a continuation header or footer, worked out once for all the places a table is split.
+    The names of the variables the rows use are found up front; the merged and normalised rows are then kept and used
+    again for as long as those variables have the same values. The rows' cell styles are only made once.
+    """
+
+    def __init__(self, row_data):
+        self.row_data = row_data
+        style = CellStyle('header_footer')
+        self.cell_styles = [[style] * len(row) for row in row_data]
+        self.names = self.get_variable_names(row_data)
+        self._key = None
+        self._rows = None
+
+    @staticmethod
+    def get_variable_names(row_data):
+        """
+        Returns the names of the variables used in the rows or None if they can't be told (a cell holding an object
+        that's merged some other way)
+        """
+        names = set()
+        for row in row_data:
+            for col in row:
+                if isinstance(col, DataParagraph):
+                    text = col.text
+                elif isinstance(col, Paragraph) or not col:
+                    continue
+                elif isinstance(col, DecimalText):
+                    text = col.m_text
+                elif isinstance(col, string_types):
+                    text = col
+                elif isinstance(col, bytes):
+                    text = col.decode('utf-8', 'ignore')
+                else:
+                    return None
+                names.update(VARIABLE_NAME_RE.findall(text))
+        return tuple(sorted(names))
+
+    def get_row_data(self, variables, merge_func, normalize_func):
+        """
+        @type   merge_func : callable
+        @param  merge_func : merges the variables into the rows, see EnhancedTable.merge_variables_into_data
+        @type   normalize_func : callable
+        @param  normalize_func : normalises the merged rows, see Table.normalizeData
+        """
+        if self.names is None:
+            return normalize_func(merge_func(self.row_data, variables))
+        key = (True,) + tuple(variables.get(name) for name in self.names) if variables else (False,)
+        if key != self._key:
+            self._rows = normalize_func(merge_func(self.row_data, variables))
+            self._key = key
+        return self._rows
+
+
 class EnhancedTableData(object):
     """
     A helper class for passing data to the EnhancedTable class.
@@ -27,6 +94,12 @@ class EnhancedTableData(object):
             self.row_heights = row_heights
         self.row_length = len(self.row_data)
         self.rows_height = sum(self.row_heights)
+        self._compiled_rows = None
+
+    def get_compiled_rows(self):
+        if self._compiled_rows is None:
+            self._compiled_rows = CompiledRows(self.row_data)
+        return self._compiled_rows
 
     def reset(self):
         self.row_data = []
@@ -35,3 +108,4 @@ class EnhancedTableData(object):
         self.commands = []
         self.row_length = 0
         self.rows_height = 0
+        self._compiled_rows = None
@@ -1,3 +1,5 @@
+import copy
+
 from reportlab import rl_config
 from reportlab.lib.rl_accel import fp_str
 from reportlab.lib.utils import annotateException, flatten
@@ -6,10 +8,13 @@ from reportlab.platypus.flowables import PageBreak
 from reportlab.platypus.para import handleSpecialCharacters
 from reportlab.platypus.paragraph import Paragraph
 # noinspection PyProtectedMember
-from reportlab.platypus.tables import Table, _calc_pc, spanFixDim, CellStyle
+from reportlab.platypus.tables import Table, _calc_pc, spanFixDim, CellStyle, _isLineCommand, _setCellStyle, \
+    _SPECIALROWS
 from six import string_types
 
 from django_advanced_pdf.engine.enhanced_table.data_paragraph import DataParagraph
+from django_advanced_pdf.engine.enhanced_table.row_commands import ROW_COMMAND_LISTS, RowCommandIndex, RowCommandList, \
+    RowCommands
 from django_advanced_pdf.engine.utils import DecimalText
 
 OVERFLOW_ROW = -9999
@@ -22,6 +27,24 @@ KEEP_TYPE_START = 2
 KEEP_TYPE_MIDDLE = 3
 KEEP_TYPE_END = 4
 
+# The attributes Table._calc works out, which are saved in the layout memo
+LAYOUT_ATTRIBUTES = ('_colWidths', '_colpositions', '_width', '_rowHeights', '_rowpositions', '_height', '_hmax',
+                     '_spanRanges', '_colSpanCells', '_rowSpanCells', '_spanRects', '_vBlocks', '_hBlocks',
+                     '_hmax_spanRects', '_nosplitRanges', '_colNoSplitCells', '_rowNoSplitCells')
+# _calcSpanRects updates these in place so the memo keeps its own copy
+LAYOUT_DICT_ATTRIBUTES = ('_spanRects', '_vBlocks', '_hBlocks')
+# Commands Table._addCommand handles itself, anything else changes cell styles
+NON_CELL_COMMANDS = ('BACKGROUND', 'ROWBACKGROUNDS', 'COLBACKGROUNDS', 'SPAN', 'NOSPLIT', 'ROUNDEDCORNERS')
+
+
+def copy_cell_style(style):
+    """
+    A quick copy of a CellStyle; only the values that have been set on it are copied, the rest come from the class.
+    """
+    new_style = CellStyle.__new__(CellStyle)
+    new_style.__dict__.update(style.__dict__)
+    return new_style
+
 
 # noinspection PyPep8Naming
 class EnhancedTable(Table):
@@ -31,13 +54,29 @@ class EnhancedTable(Table):
     table splits across page boundaries.
     Data rows can be supplied with corresponding properties which indicate if a particular row is a header, total data
     or blank row. This information is used to help fine-tune where a table can be split should the need arise.
+
+    Row specific commands are held in a RowCommandIndex shared by all the pieces of a split table, so each split only
+    rewrites the commands for the rows it splits off.
+
+    Cells share CellStyle objects until a command changes them (copy on write), so a large table with a few row or
+    table wide styles only holds a few styles rather than one for every cell.
+
+    The layout worked out by _calc and calc_height_of_table is memoised for each available width, either for the exact
+    available height or, when every row was measured, for any height the whole table fits in. Adding a command clears
+    the memo.
     """
 
+    _linecmds = RowCommandList('_linecmds')
+    _bkgrndcmds = RowCommandList('_bkgrndcmds')
+    _spanCmds = RowCommandList('_spanCmds')
+    _nosplitCmds = RowCommandList('_nosplitCmds')
+
     def __init__(self, table_data, headers=None, footers=None, min_rows_after_header=1, min_rows_before_total=1,
                  col_widths=None, row_heights=None, style=None,
                  repeat_rows=0, repeat_cols=0, split_by_row=1, empty_table_action=None, ident=None,
                  h_align=None, v_align=None, normalized_data=0, cell_styles=None,
-                 _calc_row_splits=True, initial=False, pos_x=None, pos_y=None, colpositions=None):
+                 _calc_row_splits=True, initial=False, pos_x=None, pos_y=None, colpositions=None,
+                 _index_commands=True):
         """
         Class Constructor.
 
@@ -61,6 +100,8 @@ class EnhancedTable(Table):
                                         marked with a property of 'TOTAL'
         @type   _calc_row_splits      : bool
         @param  _calc_row_splits      : private parameter used to control the calculation of nosplit commands
+        @type   _index_commands       : bool
+        @param  _index_commands       : private parameter used to control whether row commands are indexed
 
         Parameters inherited from Reportlab's reportlab.platypus.tables.Table class
         =================
@@ -86,6 +127,10 @@ class EnhancedTable(Table):
         @return : An Enhanced Table object, based on ReportLab Table
         """
         self._height = 0
+        self._layout_memo = {}
+        self._index_commands = _index_commands
+        self._commands_indexed = False
+        self._row_commands = {}
         self.availWidth = 0
         self.initial = initial
         self.headers = headers
@@ -104,6 +149,11 @@ class EnhancedTable(Table):
 
         no_split_cmds = self._calc_nosplit_positions(_calc_row_splits)
 
+        if cell_styles is None and self.data:
+            default_style = CellStyle('default')
+            ncols = max(len(row) for row in self.data)
+            cell_styles = [[default_style] * ncols for _ in self.data]
+
         if no_split_cmds:
             if style:
                 style += no_split_cmds
@@ -157,8 +207,10 @@ class EnhancedTable(Table):
             if h + rh > availHeight - footer_height:
                 break
 
-            if (self.initial or i > number_of_header) and n not in impossible and\
-                    keep_with_next in [KEEP_TYPE_NA, KEEP_TYPE_END, KEEP_TYPE_MIDDLE]:
+            # the rest of a row split by _split_in_row can always be followed by a split, as it's at least one row
+            # after the continuation header
+            if (self.initial or i > number_of_header or self.properties[i].get('split_continued')) and \
+                    n not in impossible and keep_with_next in [KEEP_TYPE_NA, KEEP_TYPE_END, KEEP_TYPE_MIDDLE]:
 
                 if keep_with_next in [KEEP_TYPE_NA, KEEP_TYPE_END]:
                     use_middle = False
@@ -170,6 +222,19 @@ class EnhancedTable(Table):
 
         return split_at, header_index, footer_index
 
+    def _get_first_row_over(self, availHeight):
+        """
+        Returns the first row that doesn't fit in availHeight (less the height of its continuation footer), or None if
+        they all fit.
+        """
+        h = 0
+        for row, (rh, footer_index) in enumerate(zip(self._rowHeights, self.footers_index)):
+            footer_height = 0 if footer_index is None else self.footers[footer_index].rows_height
+            if h + rh > availHeight - footer_height:
+                return row
+            h += rh
+        return None
+
     @staticmethod
     def merge_variables_into_data(data, variables):
         """
@@ -215,6 +280,26 @@ class EnhancedTable(Table):
 
         return output
 
+    def _get_continuation_rows(self, table_data, row):
+        """
+        Returns the row data and cell styles for a continuation header or footer, with the variables from the given row
+        merged in.
+        @type   table_data : EnhancedTableData
+        @param  table_data : the header or footer
+        @type   row : int
+        @param  row : the row whose variables are used
+        @return : (row data, cell styles)
+        """
+        compiled_rows = table_data.get_compiled_rows()
+        try:
+            row_data = compiled_rows.get_row_data(self.variables[row], self.merge_variables_into_data,
+                                                  self.normalizeData)
+        except (IndexError, KeyError):
+            # If there are no variables supplied (i.e. it's a static header)
+            row_data = self.normalizeData(table_data.row_data)
+        # the tables change their rows of cells and styles in place so each gets its own lists
+        return [list(cells) for cells in row_data], [list(styles) for styles in compiled_rows.cell_styles]
+
     def _cr_1_1_enhanced(self, n, repeat_rows, header_rows, cmds):
         # Modified version of Table._cr_1_1
         for c in cmds:
@@ -245,16 +330,155 @@ class EnhancedTable(Table):
             er += n
             self._addCommand((c[0],) + ((sc, sr), (ec, er)) + c[3:])
 
-    # noinspection DuplicatedCode
+    def _index_row_commands(self):
+        """
+        Indexes the row commands the first time the table is split rather than when it's made, as the styles are
+        usually set after that (ReportXML sets them with setStyle). A piece split off an indexed table already has its
+        view of the index from _set_split_row_commands so isn't indexed again.
+        """
+        self._commands_indexed = True
+        if not self._index_commands or self._row_commands:
+            return
+        for name in ROW_COMMAND_LISTS:
+            commands, index = RowCommandIndex.split_off(getattr(self, name), self.repeatRows)
+            if index is not None:
+                setattr(self, name, commands)
+                self._row_commands[name] = RowCommands(index)
+
+    def _get_split_commands(self, name, n):
+        """
+        Returns the commands that need rewriting when the table is split at row n. These are the commands held on the
+        table plus any indexed commands that start before row n; the indexed commands after that are passed on to the
+        second part of the table by _set_split_row_commands.
+        """
+        commands = self.__dict__[name]
+        row_commands = self._row_commands.get(name)
+        if row_commands:
+            return commands + row_commands.take(n)
+        return commands
+
+    def _set_split_row_commands(self, table, n, shift):
+        row_commands = {}
+        for name, view in self._row_commands.items():
+            view = view.after(n, shift, split_columns=self._ncols if name == '_linecmds' else None)
+            if view:
+                row_commands[name] = view
+        table._row_commands = row_commands
+        table._layout_memo = {}
+
+    def _addCommand(self, cmd):
+        if cmd[0] in NON_CELL_COMMANDS or _isLineCommand(cmd):
+            if self._row_commands:
+                self._materialise_row_commands()
+            Table._addCommand(self, cmd)
+        else:
+            self._add_cell_command(cmd)
+        if self._layout_memo:
+            self._layout_memo = {}
+
+    def _materialise_row_commands(self):
+        """
+        Moves the indexed commands on to the table's own command lists, so commands added to a piece of a split table
+        (such as a split row's overflow styles) are kept with the rest when the piece is split again.
+        """
+        for name in self._row_commands:
+            setattr(self, name, list(getattr(self, name)))
+        self._row_commands = {}
+
+    def _add_cell_command(self, cmd):
+        # Modified version of the cell style part of Table._addCommand, cells may share styles so rather than
+        # changing a style in place a changed copy is made for each different style in the range.
+        (op, (sc, sr), (ec, er)), values = cmd[:3], cmd[3:]
+        if sr in _SPECIALROWS:
+            (self._srflcmds if sr[0] == 's' else self._sircmds).append(cmd)
+            return
+        sc, ec, sr, er = self.normCellRange(sc, ec, sr, er)
+        new_styles = {}
+        for i in range(sr, er + 1):
+            row = self._cellStyles[i]
+            for j in range(sc, ec + 1):
+                style = row[j]
+                new_style = new_styles.get(id(style))
+                if new_style is None:
+                    new_style = copy_cell_style(style)
+                    _setCellStyle([[new_style]], 0, 0, op, values)
+                    new_styles[id(style)] = new_style
+                row[j] = new_style
+
+    def get_size_report(self):
+        """
+        Returns the size of the table along with how many distinct cell styles and how many commands it holds.
+        """
+        report = {'rows': self._nrows,
+                  'columns': self._ncols,
+                  'cells': self._nrows * self._ncols,
+                  'cell_styles': len({id(style) for row in self._cellStyles for style in row})}
+        for name in ('_linecmds', '_bkgrndcmds', '_spanCmds', '_nosplitCmds'):
+            report[name] = len(self.__dict__[name])
+            row_commands = self._row_commands.get(name)
+            report[name + '_indexed'] = len(row_commands) if row_commands else 0
+        return report
+
+    def _get_layout_memo(self, kind, availWidth, availHeight):
+        memo = self._layout_memo.get((kind, availWidth, availHeight))
+        if memo is None:
+            memo = self._layout_memo.get((kind, availWidth, None))
+            if memo is not None and availHeight < memo[0]:
+                memo = None
+        return None if memo is None else memo[1]
+
+    def _set_layout_memo(self, kind, availWidth, availHeight, height, all_rows, layout):
+        """
+        @type   all_rows : bool
+        @param  all_rows : True if every row was measured, in which case the layout is also used for any available
+                           height the whole table fits in
+        """
+        self._layout_memo[(kind, availWidth, availHeight)] = (height, layout)
+        if all_rows:
+            self._layout_memo[(kind, availWidth, None)] = (height, layout)
+
+    def _save_layout(self):
+        layout = {}
+        for name in LAYOUT_ATTRIBUTES:
+            if hasattr(self, name):
+                value = getattr(self, name)
+                layout[name] = dict(value) if name in LAYOUT_DICT_ATTRIBUTES else value
+        return layout
+
+    def _restore_layout(self, layout):
+        for name, value in layout.items():
+            setattr(self, name, dict(value) if name in LAYOUT_DICT_ATTRIBUTES else value)
+
     def _splitRows(self, availHeight, doInRowSplit=0):
+        if not self._commands_indexed:
+            self._index_row_commands()
 
         n, header_index, footer_index = self._getFirstPossibleSplitRowPosition(availHeight, ignoreSpans=doInRowSplit)
+        lim = len(self._rowHeights)
+        # the row to split within is the first one that doesn't fit, which isn't a possible split position when it
+        # comes straight after a continuation header
+        row = self._get_first_row_over(availHeight)
+        if row is not None and self.properties[row].get('split_in_row') is not None:
+            result = self._split_in_row(availHeight, row, header_index, footer_index, doInRowSplit)
+            if result:
+                return result
         if n <= self.repeatRows:
             return []
-        lim = len(self._rowHeights)
         if n == lim:  # No splitting required
             return [self]
+        return self._split_at_row(n, header_index, footer_index, doInRowSplit)
 
+    # noinspection DuplicatedCode
+    def _split_at_row(self, n, header_index, footer_index, doInRowSplit, variables_row=None, first=True, rest=True):
+        """
+        Splits the table into the rows before n and the rows from n on, adding the continuation footer and header.
+        @type   variables_row : int
+        @param  variables_row : the row whose variables are merged into the continuation header (n - 1 if None)
+        @type   rest : bool
+        @type   first : bool
+        @param  first : False to only make the part from n on
+        @param  rest : False to only make the part before n (for _split_in_row, where n can be past the last row)
+        """
         r0_end = n
 
         # Check to see if the row we are splitting on is of type 'BLANK'.
@@ -288,23 +512,12 @@ class EnhancedTable(Table):
         if footer_index is not None:
             insert_pagebreak = True
             footer_data = self.footers[footer_index]
-            try:
-                footer_row_data = self.merge_variables_into_data(footer_data.row_data, self.variables[r0_end - 1])
-            except (IndexError, KeyError):
-                footer_row_data = footer_data.row_data
-
+            footer_row_data, footer_cell_styles = self._get_continuation_rows(footer_data, r0_end - 1)
             footer_row_heights = footer_data.row_heights
             footer_row_variables = [{} for _ in footer_row_data]
             footer_keep_with_next = [0 for _ in footer_row_data]
             footer_row_properties = [{'row_type': 'HEADING', 'SPLITTABLE': False} for _ in footer_row_data]
-            footer_row_data = self.normalizeData(footer_row_data)
             footer_commands = footer_data.commands
-            for i in range(footer_data.row_length):
-                ncols = len(footer_row_data[i])
-                cellcols = []
-                for j in range(ncols):
-                    cellcols.append(CellStyle('header_footer'))
-                footer_cell_styles.append(cellcols)
 
         r0_table_data = {
             'row_data': data[:r0_end] + footer_row_data,
@@ -313,23 +526,34 @@ class EnhancedTable(Table):
             'keep_with_next': self.keep_with_next[:r0_end] + footer_keep_with_next,
         }
 
-        r0 = EnhancedTable(r0_table_data,
-                           col_widths=self._colWidths,
-                           row_heights=self._argH[:r0_end] + footer_row_heights,
-                           cell_styles=self._cellStyles[:r0_end] + footer_cell_styles,
-                           repeat_rows=repeat_rows, repeat_cols=repeat_cols,
-                           split_by_row=split_by_row, normalized_data=1,
-                           ident=ident,
-                           min_rows_after_header=self.min_rows_after_header,
-                           min_rows_before_total=self.min_rows_before_total,
-                           _calc_row_splits=False,
-                           colpositions=self._colpositions)
+        if first and r0_table_data['row_data']:
+            r0 = EnhancedTable(r0_table_data,
+                               col_widths=self._colWidths,
+                               row_heights=self._argH[:r0_end] + footer_row_heights,
+                               cell_styles=self._cellStyles[:r0_end] + footer_cell_styles,
+                               repeat_rows=repeat_rows, repeat_cols=repeat_cols,
+                               split_by_row=split_by_row, normalized_data=1,
+                               ident=ident,
+                               min_rows_after_header=self.min_rows_after_header,
+                               min_rows_before_total=self.min_rows_before_total,
+                               _calc_row_splits=False,
+                               colpositions=self._colpositions,
+                               _index_commands=self._index_commands)
+        else:
+            # only the rest is wanted, or there's nothing before n (splitting within the top row of a table with no
+            # footer)
+            r0 = None
 
         # copy the commands
 
+        bkgrnd_commands = self._get_split_commands('_bkgrndcmds', n)
+        span_commands = self._get_split_commands('_spanCmds', n)
+        nosplit_commands = self._get_split_commands('_nosplitCmds', n)
+
         A = []
         # hack up the line commands
-        for op, (sc, sr), (ec, er), weight, color, cap, dash, join, count, space in self._linecmds:
+        for op, (sc, sr), (ec, er), weight, color, cap, dash, join, count, space in \
+                self._get_split_commands('_linecmds', n):
 
             if isinstance(sr, string_types) and sr.startswith('split'):
                 A.append((op, (sc, sr), (ec, sr), weight, color, cap, dash, join, count, space))
@@ -379,13 +603,22 @@ class EnhancedTable(Table):
 
         # The following add back all the row commands (munged above) for the first n rows
 
-        r0._cr_0(n, A, self._nrows, doInRowSplit)
+        if r0 is not None:
+            r0._cr_0(n, A, self._nrows, doInRowSplit)
+
+            r0._cr_0(n, bkgrnd_commands, self._nrows, doInRowSplit)
+            r0._cr_0(n, span_commands, self._nrows, doInRowSplit)
+            r0._cr_0(n, nosplit_commands, self._nrows, doInRowSplit)
+            # r0._cr_0_footer(n, footer_commands)
+            r0._cr_1_0(HEADER_FOOTER-n, footer_commands, doInRowSplit)
 
-        r0._cr_0(n, self._bkgrndcmds, self._nrows, doInRowSplit)
-        r0._cr_0(n, self._spanCmds, self._nrows, doInRowSplit)
-        r0._cr_0(n, self._nosplitCmds, self._nrows, doInRowSplit)
-        # r0._cr_0_footer(n, footer_commands)
-        r0._cr_1_0(HEADER_FOOTER-n, footer_commands, doInRowSplit)
+        if not rest:
+            if r0 is None:
+                return []
+            r0.hAlign = self.hAlign
+            r0.vAlign = self.vAlign
+            self.onSplit(r0)
+            return [r0, PageBreak()] if insert_pagebreak else [r0]
 
         # Now we need to add any footer styles back on to the end (with all their cell ranges shifted)
         header_row_data = []
@@ -401,24 +634,13 @@ class EnhancedTable(Table):
         if header_index is not None:
             insert_pagebreak = True
             header_data = self.headers[header_index]
-            try:
-                header_row_data = self.merge_variables_into_data(header_data.row_data, self.variables[n - 1])
-            except (IndexError, KeyError):
-                # If there are no variables supplied (i.e. it's a static header)
-                header_row_data = header_data.row_data
+            header_row_data, header_cell_styles = self._get_continuation_rows(
+                header_data, n - 1 if variables_row is None else variables_row)
             header_row_heights = header_data.row_heights
-
-            for i in range(header_data.row_length):
-                ncols = len(header_row_data[i])
-                cellcols = []
-                for j in range(ncols):
-                    cellcols.append(CellStyle('header_footer'))
-                header_cell_styles.append(cellcols)
             header_row_variables = [{} for _ in header_row_data]
             header_keep_with_next = [False for _ in header_row_data]
             blank_header_data = [None for _ in header_row_data]
             header_row_properties = [{'row_type': 'HEADING', 'SPLITTABLE': False} for _ in header_row_data]
-            header_row_data = self.normalizeData(header_row_data)
             header_commands = header_data.commands
 
         # Construct the R1 row data, heights and cell styles.
@@ -454,7 +676,8 @@ class EnhancedTable(Table):
                            min_rows_after_header=self.min_rows_after_header,
                            min_rows_before_total=self.min_rows_before_total,
                            _calc_row_splits=False,
-                           colpositions=self._colpositions)
+                           colpositions=self._colpositions,
+                           _index_commands=self._index_commands)
 
         # Need to account for any header rows added when we call the following otherwise the row
         # styles will get out of step
@@ -465,22 +688,30 @@ class EnhancedTable(Table):
             # It leaves styles affecting rows 0 - repeat_rows
             r1._cr_1_0(HEADER_FOOTER, header_commands, doInRowSplit)
             r1._cr_1_1_enhanced(n, repeat_rows, header_rows, A)
-            r1._cr_1_1_enhanced(n, repeat_rows, header_rows, self._bkgrndcmds)
-            r1._cr_1_1_enhanced(n, repeat_rows, header_rows, self._spanCmds)
-            r1._cr_1_1_enhanced(n, repeat_rows, header_rows, self._nosplitCmds)
+            r1._cr_1_1_enhanced(n, repeat_rows, header_rows, bkgrnd_commands)
+            r1._cr_1_1_enhanced(n, repeat_rows, header_rows, span_commands)
+            r1._cr_1_1_enhanced(n, repeat_rows, header_rows, nosplit_commands)
         else:
             # the method _cr_1_0 moves all line commands down up by n rows
             r1._cr_1_0(n - header_rows, A, doInRowSplit)
-            r1._cr_1_0(n - header_rows, self._bkgrndcmds, doInRowSplit)
-            r1._cr_1_0(n - header_rows, self._spanCmds, doInRowSplit)
-            r1._cr_1_0(n - header_rows, self._nosplitCmds, doInRowSplit)
+            r1._cr_1_0(n - header_rows, bkgrnd_commands, doInRowSplit)
+            r1._cr_1_0(n - header_rows, span_commands, doInRowSplit)
+            r1._cr_1_0(n - header_rows, nosplit_commands, doInRowSplit)
 
         # Now we need to add back in the styles for the header rows (leaving their start/end positions as-is).
         if header_rows:
             r1._add_offset_commands(repeat_rows, header_row_styles)
 
-        r0.hAlign = r1.hAlign = self.hAlign
-        r0.vAlign = r1.vAlign = self.vAlign
+        # The indexed commands after the split are passed on without rewriting them, just moved up.
+        self._set_split_row_commands(r1, n, n - repeat_rows - header_rows)
+
+        r1.hAlign = self.hAlign
+        r1.vAlign = self.vAlign
+        if r0 is None:
+            self.onSplit(r1)
+            return [r1]
+        r0.hAlign = self.hAlign
+        r0.vAlign = self.vAlign
         self.onSplit(r0)
         self.onSplit(r1)
 
@@ -489,6 +720,169 @@ class EnhancedTable(Table):
         else:
             return [r0, r1]
 
+    def _split_in_row(self, availHeight, n, header_index, footer_index, doInRowSplit):
+        """
+        Splits row n itself when it's the first row that doesn't fit and its properties have split_in_row set.
+        The lines of each cell that fit in the height left end the first part of the table and the rest start the
+        second part. The first piece of the row gets the row's overflow top commands (or middle ones if the row has
+        already been split) and the rest gets its overflow bottom commands.
+        @type   n : int
+        @param  n : the row to split, as worked out by _getFirstPossibleSplitRowPosition
+        @return : the parts of the table or None if the row can't be split
+        """
+        if n < self.repeatRows:
+            return None
+        footer_height = 0 if footer_index is None else self.footers[footer_index].rows_height
+        height = availHeight - footer_height - sum(self._rowHeights[:n])
+        if self._rowHeights[n] <= height:
+            return None
+        properties = self.properties[n]
+        split_commands = properties['split_in_row']
+        continued = properties.get('split_continued', False)
+        # the row's cell styles before any overflow commands were applied
+        cell_styles = properties.get('split_cell_styles', self._cellStyles[n])
+        first_styles, first_commands = self._split_cell_styles(cell_styles,
+                                                               split_commands['middle' if continued else 'top'])
+        cells = self._split_row_cells(n, height, first_styles)
+        if cells is None:
+            return None
+        first_cells, rest_cells = cells
+        rest_styles, rest_commands = self._split_cell_styles(cell_styles, split_commands['bottom'])
+
+        first_parts = self._split_at_row(n + 1, header_index, footer_index, doInRowSplit, rest=False)
+        if not first_parts:
+            return None
+        r1, = self._split_at_row(n, header_index, footer_index, doInRowSplit, variables_row=n, first=False)
+        r1_row = r1._nrows - (self._nrows - n)
+        first_parts[0]._set_split_row(n, first_cells, first_styles, first_commands)
+        first_parts[0].properties[n] = dict(properties, split_bottom_commands=None)
+        # the bottom commands are only added when the piece is drawn, as it may be split within the row again
+        r1._set_split_row(r1_row, rest_cells, rest_styles, [])
+        r1.properties[r1_row] = dict(properties, split_continued=True, split_cell_styles=cell_styles,
+                                     split_bottom_commands=rest_commands)
+        return first_parts + [r1]
+
+    def _split_cell_styles(self, cell_styles, commands):
+        """
+        Returns copies of a row's cell styles with the cell commands in commands applied, along with the other commands.
+        """
+        cell_styles = list(cell_styles)
+        other_commands = []
+        for command in commands:
+            op = command[0]
+            if op in NON_CELL_COMMANDS or _isLineCommand(command):
+                other_commands.append(command)
+                continue
+            (sc, _), (ec, _) = command[1:3]
+            sc, ec = self.normCellRange(sc, ec, 0, 0)[:2]
+            for col in range(sc, ec + 1):
+                style = copy_cell_style(cell_styles[col])
+                _setCellStyle([[style]], 0, 0, op, command[3:])
+                cell_styles[col] = style
+        return cell_styles, other_commands
+
+    def _split_row_cells(self, row, height, cell_styles):
+        """
+        Returns the cells of a row split into the part that fits in height and the rest. Cells that fit go in the first
+        part and cells that can't be split go in the second. Returns None if no cell was split or the row is part of a
+        row span.
+        """
+        first_cells = []
+        rest_cells = []
+        split = False
+        for col, (value, style) in enumerate(zip(self._cellvalues[row], cell_styles)):
+            width = self._colWidths[col]
+            if self._spanCmds:
+                if (col, row) in self._rowSpanCells:
+                    return None
+                span = self._spanRanges.get((col, row))
+                if span is None:
+                    first_cells.append(value)
+                    rest_cells.append('')
+                    continue
+                width = sum(self._colWidths[span[0]:span[2] + 1])
+            width -= style.leftPadding + style.rightPadding
+            cell_height = height - style.topPadding - style.bottomPadding
+            if isinstance(value, (list, tuple)):
+                first, rest = self._split_flowables(value, width, cell_height)
+                if rest and first:
+                    split = True
+                first_cells.append(first)
+                rest_cells.append(rest)
+                continue
+            if isinstance(value, Flowable):
+                if value.wrap(width, cell_height)[1] <= cell_height:
+                    parts = [value]
+                else:
+                    parts = value.split(width, cell_height) if cell_height > 0 else []
+            elif value is None or value == '' or len(str(value).split('\n')) * style.leading <= cell_height:
+                parts = [value]
+            else:
+                parts = []
+
+            if len(parts) == 2:
+                split = True
+                first_cells.append(parts[0])
+                rest_cells.append(parts[1])
+            elif len(parts) == 1:
+                first_cells.append(parts[0])
+                rest_cells.append('')
+            else:
+                first_cells.append('')
+                rest_cells.append(value)
+        return (first_cells, rest_cells) if split else None
+
+    @staticmethod
+    def _split_flowables(flowables, width, height):
+        """
+        Splits a cell's list of flowables into the ones that fit in height (splitting the first one that doesn't fit
+        if it can be) and the rest.
+        """
+        first = []
+        for index, flowable in enumerate(flowables):
+            flowable_height = flowable.wrap(width, height)[1]
+            if flowable_height <= height:
+                first.append(flowable)
+                height -= flowable_height
+                continue
+            parts = flowable.split(width, height) if height > 0 else []
+            if len(parts) == 2:
+                return first + [parts[0]], [parts[1]] + list(flowables[index + 1:])
+            return first, list(flowables[index:])
+        return first, []
+
+    def _set_split_row(self, row, cells, cell_styles, commands):
+        """
+        Sets the cells and cell styles of a row split by _split_in_row and adds its other overflow commands (which are in
+        the row's own row numbers).
+        """
+        self._cellvalues[row] = cells
+        self._cellStyles[row] = cell_styles
+        self._argH[row] = None
+        self._add_split_row_commands(row, commands)
+        self._layout_memo = {}
+
+    def _add_split_row_commands(self, row, commands):
+        for command in commands:
+            (sc, sr), (ec, er) = command[1:3]
+            self._addCommand((command[0], (sc, sr + row), (ec, er + row)) + tuple(command[3:]))
+
+    def draw(self):
+        bottom_commands = [(row, properties['split_bottom_commands']) for row, properties in enumerate(self.properties)
+                           if properties.get('split_bottom_commands')]
+        if not bottom_commands:
+            Table.draw(self)
+            return
+        # the overflow bottom commands of a split row go on the piece holding the end of the row (see _split_in_row),
+        # which is only known once it's drawn, so it's drawn from a copy with them added, leaving the piece as it is
+        table = copy.copy(self)
+        for name in ROW_COMMAND_LISTS:
+            setattr(table, name, list(getattr(self, name)))
+        table._row_commands = {}
+        for row, commands in bottom_commands:
+            table._add_split_row_commands(row, commands)
+        Table.draw(table)
+
     @staticmethod
     def _merge_cell_styles(first, headers, last):
         if len(headers) == 0:
@@ -512,6 +906,48 @@ class EnhancedTable(Table):
 
         return first + headers_mod + last
 
+    def add_rows(self, chunk):
+        """
+        Returns a new table with the rows of a chunk added on to the end of this table's rows (see ChunkedTable).
+        @type   chunk : TableChunk
+        @param  chunk : the rows to add, with the row commands that start on them
+        @rtype  : EnhancedTable
+        """
+        nrows = self._nrows
+        style = []
+        for name in ROW_COMMAND_LISTS:
+            style += getattr(self, name)
+        for c in chunk.commands:
+            (sc, sr), (ec, er) = c[1:3]
+            style.append((c[0], (sc, sr + nrows), (ec, er + nrows)) + tuple(c[3:]))
+
+        table_data = {'row_data': self._cellvalues + chunk.row_data,
+                      'row_variables': self.variables + chunk.row_variables,
+                      'row_properties': self.properties + chunk.row_properties,
+                      'keep_with_next': self.keep_with_next + chunk.keep_with_next,
+                      'headers_index': self.headers_index + chunk.headers_index,
+                      'footers_index': self.footers_index + chunk.footers_index}
+        return EnhancedTable(table_data,
+                             headers=self.headers,
+                             footers=self.footers,
+                             min_rows_after_header=self.min_rows_after_header,
+                             min_rows_before_total=self.min_rows_before_total,
+                             col_widths=self._colWidths,
+                             row_heights=self._argH + chunk.row_heights,
+                             style=style,
+                             repeat_rows=self.repeatRows,
+                             repeat_cols=self.repeatCols,
+                             split_by_row=self.splitByRow,
+                             ident=self.ident,
+                             h_align=self.hAlign,
+                             v_align=self.vAlign,
+                             normalized_data=1,
+                             cell_styles=self._cellStyles + chunk.cell_styles,
+                             _calc_row_splits=False,
+                             initial=self.initial,
+                             colpositions=self._colpositions,
+                             _index_commands=self._index_commands)
+
     def _calc_nosplit_positions(self, _calc_row_splits):
         no_split_cmds = []
         if _calc_row_splits is True:
@@ -543,6 +979,18 @@ class EnhancedTable(Table):
 
         return super(EnhancedTable, self).drawOn(canvas, x, y, _sW)
 
+    def _calc(self, availWidth, availHeight):
+        layout = self._get_layout_memo('calc', availWidth, availHeight)
+        if layout is not None:
+            self._restore_layout(layout)
+            return
+        # working out unset column widths changes _argW so only memoise once they are known
+        memoise = None not in self._argW and '*' not in self._argW
+        Table._calc(self, availWidth, availHeight)
+        if memoise:
+            self._set_layout_memo('calc', availWidth, availHeight, self._height, self._hmax == self._nrows,
+                                  self._save_layout())
+
     def wrap(self, availWidth, availHeight):
         self._calc(availWidth, availHeight)
         self.availWidth = availWidth
@@ -552,8 +1000,20 @@ class EnhancedTable(Table):
 
         return self._width, self._height
 
-    # noinspection PyProtectedMember
     def calc_height_of_table(self, availHeight, availWidth, H=None, W=None):
+        if W:
+            return self._calc_height_of_table(availHeight, availWidth, H, W)
+        memo = self._get_layout_memo('height', availWidth, availHeight)
+        if memo is not None:
+            height, height_max, self._rowHeights, self._rowpositions = memo
+            return height, height_max
+        height, height_max = self._calc_height_of_table(availHeight, availWidth, H, W)
+        self._set_layout_memo('height', availWidth, availHeight, height, height_max == len(self._argH),
+                              (height, height_max, self._rowHeights, self._rowpositions))
+        return height, height_max
+
+    # noinspection PyProtectedMember
+    def _calc_height_of_table(self, availHeight, availWidth, H=None, W=None):
         _ = H  # remove pep8
         H = self._argH
         if not W:
@@ -606,7 +1066,8 @@ class EnhancedTable(Table):
 
                 for j, (v, s, w) in enumerate(list(zip(V, S, W))):  # value, style, width (lengths must match)
                     ji = j, i
-                    if next_find_type == OVERFLOW_ROW:
+                    if next_find_type == OVERFLOW_ROW and s.leading != 1:
+                        s = S[j] = copy_cell_style(s)  # the style may be shared with other cells
                         s.leading = 1
                     span = spanRanges.get(ji, None)
                     if ji in rowSpanCells and not span:
@@ -627,15 +1088,18 @@ class EnhancedTable(Table):
                                 if not span:
                                     continue
                                 w = max(colpositions[span[2] + 1] - colpositions[span[0]], w)
-                            dW, t = self._listCellGeom(v, w or self._listValueWidth(v), s)
+                            t = self._estimate_cell_height(v, w, s)
+                            if t is None:
+                                dW, t = self._listCellGeom(v, w or self._listValueWidth(v), s)
+                                dW = dW + s.leftPadding + s.rightPadding
+                                if not rl_config.allowTableBoundsErrors and dW > w:
+                                    from reportlab.platypus.doctemplate import LayoutError
+                                    raise LayoutError(
+                                        "Flowable %s (%sx%s points) too wide for cell(%d,%d) (%sx* points) in\n%s" % (
+                                            v[0].identity(30), fp_str(dW), fp_str(t), i, j, fp_str(w),
+                                            self.identity(30)))
                             if canv:
                                 canv._fontname, canv._fontsize, canv._leading = saved
-                            dW = dW + s.leftPadding + s.rightPadding
-                            if not rl_config.allowTableBoundsErrors and dW > w:
-                                from reportlab.platypus.doctemplate import LayoutError
-                                raise LayoutError(
-                                    "Flowable %s (%sx%s points) too wide for cell(%d,%d) (%sx* points) in\n%s" % (
-                                        v[0].identity(30), fp_str(dW), fp_str(t), i, j, fp_str(w), self.identity(30)))
                         else:
                             v = (v is not None and str(v) or '').split("\n")
                             t = (s.leading or 1.2 * s.fontsize) * len(v)
@@ -689,6 +1153,19 @@ class EnhancedTable(Table):
         j.reverse()  # reverse the reversed list of row positions
         return height, hmax
 
+    @staticmethod
+    def _estimate_cell_height(v, w, s):
+        """
+        Returns the height of a cell holding a single paragraph that can work out its height without being wrapped
+        (see EnhancedParagraph.estimate_height), otherwise None and the cell has to be measured.
+        """
+        if w is None or len(v) != 1 or not rl_config.allowTableBoundsErrors:
+            return None
+        estimate_height = getattr(v[0], 'estimate_height', None)
+        if estimate_height is None:
+            return None
+        return estimate_height(w - s.leftPadding - s.rightPadding)
+
     def _calc_height(self, availHeight, availWidth, H=None, W=None):
         height, height_max = self.calc_height_of_table(availHeight, availWidth, H, W)
         self._height = height
@@ -0,0 +1,137 @@
+from bisect import bisect_left
+
+from six import string_types
+
+ROW_COMMAND_LISTS = ('_linecmds', '_bkgrndcmds', '_spanCmds', '_nosplitCmds')
+
+
+class RowCommandIndex(object):
+    """
+    The row specific commands of a table (e.g. the background and lines added for each tr), held in the row
+    coordinates of the original table and sorted by start row so the commands for any run of rows can be found with a
+    binary search. The index is built once and shared by every piece the table gets split into.
+    """
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.starts = [command[1][1] for command in commands]
+
+    @staticmethod
+    def can_index(command, repeat_rows):
+        (_, sr), (_, er) = command[1:3]
+        if isinstance(sr, string_types) or isinstance(er, string_types):
+            return False
+        return repeat_rows <= sr <= er
+
+    @classmethod
+    def split_off(cls, commands, repeat_rows):
+        """
+        Splits a command list into the commands that have to stay on the table and the longest run at the end of the
+        list that can be indexed. Only a run at the end is taken (and only while the start rows are in order) so the
+        order the commands are drawn in is kept.
+        @return : (commands to keep, RowCommandIndex or None)
+        """
+        position = len(commands)
+        next_start = None
+        while position > 0:
+            command = commands[position - 1]
+            if not cls.can_index(command, repeat_rows):
+                break
+            start = command[1][1]
+            if next_start is not None and start > next_start:
+                break
+            next_start = start
+            position -= 1
+        if position == len(commands):
+            return commands, None
+        return commands[:position], cls(commands[position:])
+
+
+class RowCommands(object):
+    """
+    One table piece's view of a RowCommandIndex.
+    The piece uses the indexed commands from position onwards, with their rows moved up by offset. Splitting a piece
+    only needs the commands that start on the rows being split off; the rest are passed to the next piece by moving
+    position and offset rather than by rewriting every command.
+    """
+
+    def __init__(self, index, position=0, offset=0, split_columns=None):
+        self.index = index
+        self.position = position
+        self.offset = offset
+        # set (to the number of columns) for line commands that have been through a split, which resolves negative
+        # columns and rebuilds LINEBELOW commands with the default cap, dash and join, see EnhancedTable._splitRows
+        self.split_columns = split_columns
+        self.materialised = None
+
+    def __len__(self):
+        return len(self.index.commands) - self.position
+
+    def translate(self, command):
+        op, (sc, sr), (ec, er) = command[:3]
+        sr -= self.offset
+        er -= self.offset
+        ncols = self.split_columns
+        if ncols is None:
+            return (op, (sc, sr), (ec, er)) + tuple(command[3:])
+        if sc < 0:
+            sc += ncols
+        if ec < 0:
+            ec += ncols
+        if op == 'LINEBELOW':
+            weight, color = command[3:5]
+            return op, (sc, sr), (ec, er), weight, color, 1, None, 1, 1, weight
+        return (op, (sc, sr), (ec, er)) + tuple(command[3:])
+
+    def end_position(self, row):
+        return bisect_left(self.index.starts, row + self.offset, self.position)
+
+    def take(self, row):
+        """
+        Returns the commands that start before row (in the piece's row numbers).
+        """
+        end = self.end_position(row)
+        return [self.translate(command) for command in self.index.commands[self.position:end]]
+
+    def after(self, row, shift, split_columns=None):
+        """
+        Returns the view for the piece that starts at row, where the piece's row numbers are shift less than this
+        piece's.
+        """
+        return RowCommands(index=self.index,
+                           position=self.end_position(row),
+                           offset=self.offset + shift,
+                           split_columns=split_columns if split_columns is not None else self.split_columns)
+
+    def materialise(self):
+        return [self.translate(command) for command in self.index.commands[self.position:]]
+
+
+class RowCommandList(object):
+    """
+    Descriptor used for a table's command lists (_linecmds etc). The list held on the table is returned as is unless
+    the table has indexed commands, in which case they are added on the end the first time the list is needed (when
+    the table is drawn for instance). EnhancedTable._addCommand moves the indexed commands back on to the table's
+    own lists before adding to them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, table, owner=None):
+        if table is None:
+            return self
+        try:
+            commands = table.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+        row_commands = table.__dict__.get('_row_commands')
+        view = row_commands.get(self.name) if row_commands else None
+        if not view:
+            return commands
+        if view.materialised is None:
+            view.materialised = commands + view.materialise()
+        return view.materialised
+
+    def __set__(self, table, value):
+        table.__dict__[self.name] = value
@@ -0,0 +1,87 @@
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+# number of rows a chain of changes can grow to before a row holds all of the variables again
+MAX_CHAIN_LENGTH = 32
+
+
+class RowVariables(Mapping):
+    """
+    The variables as they stand at the end of one table row (running totals etc).
+    Each row only holds the variables it changed and looks the rest up in the row before it, so a table's rows share
+    their values rather than each holding a full copy. Every MAX_CHAIN_LENGTH rows the chain is started again with a
+    full copy, which keeps a look up to a bounded number of steps. The first time a row is used in full (for example
+    to merge its values into a header or footer at a split) its values are collected into a dict that's kept for any
+    further use.
+    """
+
+    __slots__ = ('parent', 'changes', 'chain_length', '_resolved')
+
+    def __init__(self, parent=None, changes=None):
+        if parent is not None and parent.chain_length >= MAX_CHAIN_LENGTH:
+            changes = {**parent.collect(), **(changes or {})}
+            parent = None
+        self.parent = parent
+        self.changes = changes if changes is not None else {}
+        self.chain_length = 0 if parent is None else parent.chain_length + 1
+        self._resolved = None
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+        self._resolved = None
+
+    def collect(self):
+        """
+        Returns all the variables for this row without keeping them
+        """
+        if self._resolved is not None:
+            return self._resolved
+        if self.parent is None:
+            return self.changes
+        chain = []
+        row = self
+        while row is not None:
+            chain.append(row.changes)
+            row = row.parent
+        variables = {}
+        for changes in reversed(chain):
+            variables.update(changes)
+        return variables
+
+    def resolved(self):
+        if self._resolved is None:
+            self._resolved = self.collect()
+        return self._resolved
+
+    def __getitem__(self, key):
+        return self.resolved()[key]
+
+    def __iter__(self):
+        return iter(self.resolved())
+
+    def __len__(self):
+        return len(self.resolved())
+
+    def __repr__(self):
+        return 'RowVariables(%r)' % self.resolved()
+
+
+class TableVariables(dict):
+    """
+    The running variables while a table is being built. It keeps the last row's RowVariables so the next row can be
+    chained on to it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_row = None
+
+    def new_row(self):
+        if self.last_row is None:
+            row_variables = RowVariables(changes=dict(self))
+        else:
+            row_variables = RowVariables(parent=self.last_row)
+        self.last_row = row_variables
+        return row_variables
@@ -0,0 +1,191 @@
+from bisect import bisect_left
+
+from reportlab.platypus.flowables import Flowable
+
+from django_advanced_pdf.engine.enhanced_table.enhanced_tables import EnhancedTable
+from django_advanced_pdf.engine.enhanced_table.row_commands import ROW_COMMAND_LISTS, RowCommandIndex
+
+# the number of rows in each chunk when a table doesn't say (chunk_rows="auto")
+DEFAULT_CHUNK_ROWS = 500
+
+
+class TableChunk(object):
+    """
+    Rows of a table waiting to be added on to a ChunkedTable, along with the row commands that start on them (in the
+    chunk's own row numbers).
+    """
+
+    __slots__ = ('row_data', 'row_variables', 'row_properties', 'keep_with_next', 'headers_index', 'footers_index',
+                 'row_heights', 'cell_styles', 'commands')
+
+    def __init__(self, table, start, end, commands):
+        self.row_data = table._cellvalues[start:end]
+        self.row_variables = table.variables[start:end]
+        self.row_properties = table.properties[start:end]
+        self.keep_with_next = table.keep_with_next[start:end]
+        self.headers_index = table.headers_index[start:end]
+        self.footers_index = table.footers_index[start:end]
+        self.row_heights = table._argH[start:end]
+        self.cell_styles = table._cellStyles[start:end]
+        self.commands = commands
+
+
+class ChunkedTable(Flowable):
+    """
+    A long table laid out a chunk of rows at a time.
+    The table only holds the rows it needs to fill the space it's given; before it's wrapped or split more chunks are
+    added on until the rows don't all fit (or there are none left). Splitting a table only looks at the rows that fit
+    plus the one that doesn't, so the table splits at the same rows as it would if it held every row, while each split
+    only has to copy and measure the rows held rather than the rest of the table.
+    """
+
+    def __init__(self, table, chunks):
+        Flowable.__init__(self)
+        self.table = table
+        self.chunks = chunks
+
+    def _wrap_table(self, availWidth, availHeight):
+        canv = getattr(self, 'canv', None)
+        if canv is not None:
+            self.table.canv = canv
+        try:
+            width, height = self.table.wrap(availWidth, availHeight)
+            while self.chunks and height <= availHeight:
+                self.table = self.table.add_rows(self.chunks.pop(0))
+                if canv is not None:
+                    self.table.canv = canv
+                width, height = self.table.wrap(availWidth, availHeight)
+        finally:
+            if canv is not None:
+                del self.table.canv
+        return width, height
+
+    def wrap(self, availWidth, availHeight):
+        self.width, self.height = self._wrap_table(availWidth, availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        self._wrap_table(availWidth, availHeight)
+        parts = self.table.split(availWidth, availHeight)
+        if parts and self.chunks:
+            parts[-1] = ChunkedTable(parts[-1], list(self.chunks))
+        return parts
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        self.table.drawOn(canvas, x, y, _sW=_sW)
+
+    def getSpaceBefore(self):
+        return self.table.getSpaceBefore()
+
+    def getSpaceAfter(self):
+        return self.table.getSpaceAfter()
+
+
+def absolute_rows(command, nrows):
+    (sc, sr), (ec, er) = command[1:3]
+    if isinstance(sr, int) and sr < 0:
+        sr += nrows
+    if isinstance(er, int) and er < 0:
+        er += nrows
+    return (command[0], (sc, sr), (ec, er)) + tuple(command[3:])
+
+
+def chunk_boundaries(nrows, chunk_rows, ranges):
+    """
+    Returns the rows the chunks start at, roughly chunk_rows apart and never inside a span or nosplit range.
+    @type   ranges : list
+    @param  ranges : (start row, end row) of each span and nosplit command
+    """
+    blocked = set()
+    for start_row, end_row in ranges:
+        blocked.update(range(start_row + 1, end_row + 1))
+    boundaries = []
+    row = chunk_rows
+    while row < nrows:
+        if row not in blocked:
+            boundaries.append(row)
+            row += chunk_rows
+        else:
+            row += 1
+    return boundaries
+
+
+def chunk_table(table, chunk_rows):
+    """
+    Returns a ChunkedTable holding the rows of the table in chunks of about chunk_rows rows, or the table itself if
+    it's too short to chunk or has commands that can't be shared out between chunks.
+
+    Line commands that count rows from the end of the table are given absolute rows, as splitting a table works them
+    out from its own last row. The other commands keep their negative rows, which are left as they are when a table is
+    split, so they still refer to the last row once all the rows have been added.
+    @type   table : EnhancedTable
+    @param  table : table holding every row, with its styles set
+    @type   chunk_rows : int
+    @param  chunk_rows : number of rows in each chunk, 0 not to chunk the table
+    @rtype  : ChunkedTable or EnhancedTable
+    """
+    nrows = table._nrows
+    if (not chunk_rows or nrows <= chunk_rows or table.repeatRows or table._srflcmds or table._sircmds or
+            table.pos_x is not None or table.pos_y is not None):
+        return table
+
+    table_commands = {}
+    indexes = {}
+    ranges = []
+    for name in ROW_COMMAND_LISTS:
+        commands, index = RowCommandIndex.split_off(getattr(table, name), table.repeatRows)
+        if name == '_linecmds':
+            commands = [absolute_rows(command, nrows) for command in commands]
+        elif name in ('_spanCmds', '_nosplitCmds'):
+            for command in commands:
+                (_, start_row), (_, end_row) = command[1:3]
+                if not isinstance(start_row, int) or not isinstance(end_row, int) or start_row < 0 or end_row < 0:
+                    return table
+                ranges.append((start_row, end_row))
+            if index is not None:
+                ranges.extend((command[1][1], command[2][1]) for command in index.commands)
+        table_commands[name] = commands
+        indexes[name] = index
+
+    starts = [0] + chunk_boundaries(nrows, chunk_rows, ranges)
+    if len(starts) == 1:
+        return table
+    ends = starts[1:] + [nrows]
+
+    chunks = []
+    for start, end in zip(starts, ends):
+        commands = []
+        for name in ROW_COMMAND_LISTS:
+            index = indexes[name]
+            if index is not None:
+                commands += index.commands[bisect_left(index.starts, start):bisect_left(index.starts, end)]
+        commands = [(command[0], (command[1][0], command[1][1] - start), (command[2][0], command[2][1] - start)) +
+                    tuple(command[3:]) for command in commands]
+        chunks.append(TableChunk(table, start, end, commands))
+
+    first = chunks.pop(0)
+    style = [command for name in ROW_COMMAND_LISTS for command in table_commands[name]] + first.commands
+    first_table = EnhancedTable({'row_data': first.row_data,
+                                 'row_variables': first.row_variables,
+                                 'row_properties': first.row_properties,
+                                 'keep_with_next': first.keep_with_next,
+                                 'headers_index': first.headers_index,
+                                 'footers_index': first.footers_index},
+                                headers=table.headers,
+                                footers=table.footers,
+                                min_rows_after_header=table.min_rows_after_header,
+                                min_rows_before_total=table.min_rows_before_total,
+                                col_widths=table._colWidths,
+                                row_heights=first.row_heights,
+                                style=style,
+                                repeat_rows=table.repeatRows,
+                                split_by_row=table.splitByRow,
+                                ident=table.ident,
+                                h_align=table.hAlign,
+                                v_align=table.vAlign,
+                                normalized_data=1,
+                                cell_styles=first.cell_styles,
+                                _calc_row_splits=False,
+                                initial=table.initial,
+                                _index_commands=table._index_commands)
+    return ChunkedTable(first_table, chunks)
@@ -0,0 +1,241 @@
+from reportlab.lib.rl_accel import unicode2T1
+from reportlab.pdfbase.pdfmetrics import getFont, stringWidth
+from reportlab.pdfbase.ttfonts import TTFont
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+BLOCK_SIZE = 256
+BMP_SIZE = 0x10000
+
+
+class FontWidths(object):
+    """
+    Per-font glyph width table used to measure many strings at once.
+    Widths are held in font units (1/1000 of the font size) for every code point in the Basic Multilingual Plane.
+    The table is filled lazily, one block of 256 code points at a time, the first time a character from that block
+    is measured. Totals are worked out the same way as reportlab's stringWidth (sum of unit widths * 0.001 * size)
+    so the results match it exactly for fonts with integer glyph widths (all the standard Type 1 fonts).
+    """
+
+    def __init__(self, font_name):
+        self.font_name = font_name
+        self.font = getFont(font_name)
+        self._astral_widths = {}
+        self._loaded_blocks = set()
+        if np is not None:
+            self._table = np.zeros(BMP_SIZE, dtype=np.float64)
+        else:
+            self._table = [0.0] * BMP_SIZE
+
+    def _unit_width(self, char):
+        font = self.font
+        if isinstance(font, TTFont):
+            return font.face.charWidths.get(ord(char), font.face.defaultWidth)
+        if hasattr(font, 'widths') and hasattr(font, 'substitutionFonts'):
+            return sum(sum(map(f.widths.__getitem__, t)) for f, t in unicode2T1(char, [font] + font.substitutionFonts))
+        return stringWidth(char, self.font_name, 1000)
+
+    def _load_block(self, block):
+        start = block * BLOCK_SIZE
+        for code_point in range(start, start + BLOCK_SIZE):
+            if 0xD800 <= code_point <= 0xDFFF:
+                continue  # surrogates can't be encoded on their own
+            self._table[code_point] = self._unit_width(chr(code_point))
+        self._loaded_blocks.add(block)
+
+    def _astral_width(self, code_point):
+        width = self._astral_widths.get(code_point)
+        if width is None:
+            width = self._unit_width(chr(code_point))
+            self._astral_widths[code_point] = width
+        return width
+
+    def _code_points(self, text):
+        if np is not None:
+            return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        return [ord(c) for c in text]
+
+    def unit_widths(self, text):
+        """
+        Returns the width in font units of each character in text
+        """
+        code_points = self._code_points(text)
+        if np is not None:
+            if len(code_points) == 0:
+                return np.zeros(0, dtype=np.float64)
+            bmp = code_points < BMP_SIZE
+            blocks = np.unique(code_points[bmp] >> 8)
+            for block in blocks.tolist():
+                if block not in self._loaded_blocks:
+                    self._load_block(block)
+            if bmp.all():
+                return self._table.take(code_points)
+            widths = self._table.take(np.where(bmp, code_points, 0))
+            widths[~bmp] = [self._astral_width(c) for c in code_points[~bmp].tolist()]
+            return widths
+
+        widths = []
+        for code_point in code_points:
+            if code_point >= BMP_SIZE:
+                widths.append(self._astral_width(code_point))
+                continue
+            block = code_point >> 8
+            if block not in self._loaded_blocks:
+                self._load_block(block)
+            widths.append(self._table[code_point])
+        return widths
+
+    @staticmethod
+    def _total(widths):
+        if np is not None:
+            return float(widths.sum())
+        return sum(widths)
+
+    def string_width(self, text, font_size):
+        if isinstance(text, bytes):
+            text = text.decode('utf8')
+        return self._total(self.unit_widths(text)) * 0.001 * font_size
+
+    def token_widths(self, tokens, font_size):
+        """
+        Measures a whole list of tokens (e.g. the words of a paragraph) in a single pass.
+        All the tokens are joined, looked up in the width table in one go and the per-token totals are taken from a
+        running (cumulative) sum at the token boundaries.
+        @type   tokens : list
+        @param  tokens : list of strings to measure
+        @type   font_size : float
+        @param  font_size : font size in points
+        @return : list of widths in points, one per token
+        """
+        if not tokens:
+            return []
+        widths = self.unit_widths(''.join(tokens))
+        if np is not None:
+            ends = np.cumsum([len(token) for token in tokens])
+            running = np.concatenate(([0.0], np.cumsum(widths)))
+            starts = np.concatenate(([0], ends[:-1]))
+            return ((running[ends] - running[starts]) * 0.001 * font_size).tolist()
+
+        output = []
+        position = 0
+        for token in tokens:
+            end = position + len(token)
+            output.append(sum(widths[position:end]) * 0.001 * font_size)
+            position = end
+        return output
+
+    def fit_tokens(self, tokens, font_size, avail_width, suffix=''):
+        """
+        Vectorised version of fit_text for a list of tokens that all have the same available width.
+        @return : (tokens, widths) with any tokens that were too wide cut down, and the width of each in points
+        """
+        if np is None or not tokens:
+            output = []
+            widths = []
+            for token in tokens:
+                token = self.fit_text(token, font_size, avail_width, suffix=suffix)
+                output.append(token)
+                widths.append(self.string_width(token, font_size))
+            return output, widths
+
+        widths = self.unit_widths(''.join(tokens))
+        ends = np.cumsum([len(token) for token in tokens])
+        starts = np.concatenate(([0], ends[:-1]))
+        running = np.concatenate(([0.0], np.cumsum(widths)))
+        totals = running[ends] - running[starts]
+        limit = avail_width / (0.001 * font_size)
+        too_wide = np.flatnonzero(totals > limit)
+        if len(too_wide) == 0:
+            return tokens, (totals * 0.001 * font_size).tolist()
+
+        suffix_width = self._total(self.unit_widths(suffix)) if suffix else 0
+        cut_starts = starts[too_wide]
+        cut_limits = running[cut_starts] + limit - suffix_width + 1e-9
+        counts = np.maximum(np.searchsorted(running, cut_limits, side='right') - 1 - cut_starts, 0)
+        totals[too_wide] = running[cut_starts + counts] - running[cut_starts] + suffix_width
+        tokens = list(tokens)
+        for index, count in zip(too_wide.tolist(), counts.tolist()):
+            tokens[index] = tokens[index][:count] + suffix
+        return tokens, (totals * 0.001 * font_size).tolist()
+
+    def fit_text(self, text, font_size, avail_width, suffix=''):
+        """
+        Cuts text down to the leading characters that fit within avail_width.
+        If the text has to be cut, suffix (e.g. an ellipsis) is added to the end and room is left for it.
+        """
+        widths = self.unit_widths(text)
+        limit = avail_width / (0.001 * font_size)
+        if self._total(widths) <= limit:
+            return text
+        if suffix:
+            limit -= self._total(self.unit_widths(suffix))
+        if np is not None:
+            count = int(np.searchsorted(np.cumsum(widths), limit + 1e-9, side='right'))
+        else:
+            count = 0
+            running = 0
+            for width in widths:
+                running += width
+                if running > limit + 1e-9:
+                    break
+                count += 1
+        return text[:count] + suffix
+
+
+_font_widths = {}
+
+
+def get_font_widths(font_name):
+    font_widths = _font_widths.get(font_name)
+    if font_widths is None:
+        font_widths = FontWidths(font_name)
+        _font_widths[font_name] = font_widths
+    return font_widths
+
+
+def string_width(text, font_name, font_size):
+    return get_font_widths(font_name).string_width(text, font_size)
+
+
+def break_words(words, font_name, font_size, max_widths, space_shrinkage=0, word_widths=None):
+    """
+    Greedy line breaker for a run of words that share a single font and size.
+    This follows the same rules as the single fragment case of reportlab's Paragraph.breakLines (including space
+    shrinkage) but measures all the words up front with token_widths.
+    Long words are not split; the caller should check for them first.
+    @type   max_widths : list
+    @param  max_widths : available width for each line, the last one is repeated
+    @return : (lines, width_max) where lines is a list of (unused width, word list)
+    """
+    if word_widths is None:
+        word_widths = get_font_widths(font_name).token_widths(words, font_size)
+    space_width = string_width(' ', font_name, font_size)
+    space_shrink = space_shrinkage * space_width
+    max_line_number = len(max_widths) - 1
+    line_number = 0
+    max_width = max_widths[0]
+    width_max = 0
+    lines = []
+    current_line = []
+    current_width = -space_width
+    for word, word_width in zip(words, word_widths):
+        new_width = current_width + space_width + word_width
+        if new_width <= max_width + space_shrink * len(current_line) or not current_line:
+            current_line.append(word)
+            current_width = new_width
+        else:
+            if current_width > width_max:
+                width_max = current_width
+            lines.append((max_width - current_width, current_line))
+            current_line = [word]
+            current_width = word_width
+            line_number += 1
+            max_width = max_widths[min(max_line_number, line_number)]
+    if current_line:
+        if current_width > width_max:
+            width_max = current_width
+        lines.append((max_width - current_width, current_line))
+    return lines, width_max
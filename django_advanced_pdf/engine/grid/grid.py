@@ -0,0 +1,180 @@
+from reportlab.lib.colors import black
+from reportlab.lib.units import mm
+from reportlab.lib.rl_accel import escapePDF
+from reportlab.pdfbase.pdfmetrics import getAscentDescent, getFont
+from reportlab.platypus.flowables import Flowable
+
+from django_advanced_pdf.engine.font_metrics import get_font_widths
+
+OVERFLOW_CLIP = 'clip'
+OVERFLOW_ELLIPSIS = 'ellipsis'
+ELLIPSIS = '…'
+
+
+class GridColumn(object):
+    """
+    The settings for one column of a Grid. Every cell in a column shares the same single line text style.
+    """
+
+    def __init__(self, width, title='', font_name='Helvetica', font_size=8, text_color=black, align='LEFT',
+                 overflow=OVERFLOW_CLIP, header_font_name=None):
+        self.width = width
+        self.title = title
+        self.font_name = font_name
+        self.font_size = font_size
+        self.text_color = text_color
+        self.align = align.upper()
+        self.overflow = overflow
+        self.header_font_name = header_font_name if header_font_name is not None else font_name
+
+
+class Grid(Flowable):
+    """
+    A lightweight table for large data dumps (audit logs, stock lists etc).
+    Each cell is a single line of text in its column's style, so no per cell flowables are created. Rows are a fixed
+    height which means the table can be paginated with simple arithmetic and each page's text is drawn in a single
+    BT/ET text block straight on to the canvas. The header row is repeated on every page.
+
+    The rows are shared between all the pieces the grid is split into; each piece just holds a start and stop row.
+    """
+
+    def __init__(self, columns, rows, row_height, padding=1 * mm, show_header=True, header_background=None,
+                 row_line=None, box=None, start=0, stop=None):
+        """
+        @type   columns : list
+        @param  columns : list of GridColumn
+        @type   rows : list
+        @param  rows : list of rows, each row being a list of strings (one per column)
+        @type   row_height : float
+        @param  row_height : height of every row in points
+        @type   row_line : tuple
+        @param  row_line : (weight, color) for the lines between the rows
+        @type   box : tuple
+        @param  box : (weight, color) for the line round the outside of each page of the grid
+        """
+        Flowable.__init__(self)
+        self.columns = columns
+        self.rows = rows
+        self.row_height = row_height
+        self.padding = padding
+        self.show_header = show_header
+        self.header_background = header_background
+        self.row_line = row_line
+        self.box = box
+        self.start = start
+        self.stop = len(rows) if stop is None else stop
+        self.width = sum(column.width for column in columns)
+        self.height = 0
+
+    def header_height(self):
+        return self.row_height if self.show_header else 0
+
+    def wrap(self, availWidth, availHeight):
+        self.height = self.header_height() + (self.stop - self.start) * self.row_height
+        return self.width, self.height
+
+    def piece(self, start, stop):
+        return Grid(columns=self.columns,
+                    rows=self.rows,
+                    row_height=self.row_height,
+                    padding=self.padding,
+                    show_header=self.show_header,
+                    header_background=self.header_background,
+                    row_line=self.row_line,
+                    box=self.box,
+                    start=start,
+                    stop=stop)
+
+    def split(self, availWidth, availHeight):
+        fit = int((availHeight - self.header_height() + 1e-8) // self.row_height)
+        if fit <= 0:
+            return []
+        if self.start + fit >= self.stop:
+            return [self]
+        return [self.piece(self.start, self.start + fit), self.piece(self.start + fit, self.stop)]
+
+    def fit_cells(self, column, texts, font_name):
+        """
+        Measures all of a column's cells on this page in one go and cuts down any that are too wide
+        """
+        suffix = ELLIPSIS if column.overflow == OVERFLOW_ELLIPSIS else ''
+        return get_font_widths(font_name).fit_tokens(texts, column.font_size, column.width - 2 * self.padding,
+                                                     suffix=suffix)
+
+    @staticmethod
+    def get_text_code(text_object, font_name, texts):
+        """
+        Returns the PDF operators that show each text. Text in a WinAnsi font (the standard fonts) that can be encoded
+        directly is escaped straight away, anything else goes through reportlab's own text formatting.
+        """
+        font = getFont(font_name)
+        if font._dynamicFont or font._multiByte or font.encName != 'WinAnsiEncoding':
+            return [text_object._formatText(text) for text in texts]
+        code = []
+        for text in texts:
+            try:
+                code.append('(%s) Tj' % escapePDF(text.encode(font.encName)))
+            except UnicodeEncodeError:
+                code.append(text_object._formatText(text))
+        return code
+
+    def draw(self):
+        canv = self.canv
+        row_height = self.row_height
+        header_height = self.header_height()
+        rows = self.rows[self.start:self.stop]
+
+        if self.header_background is not None and header_height:
+            canv.setFillColor(self.header_background)
+            canv.rect(0, self.height - header_height, self.width, header_height, stroke=0, fill=1)
+
+        text_object = canv.beginText()
+        current_font = current_color = None
+        x = 0
+        for col_index, column in enumerate(self.columns):
+            texts = [str(row[col_index]) if col_index < len(row) and row[col_index] is not None else ''
+                     for row in rows]
+            lines = [(column.header_font_name, [column.title], self.height)] if header_height else []
+            lines.append((column.font_name, texts, self.height - header_height))
+
+            for font_name, line_texts, top in lines:
+                line_texts, widths = self.fit_cells(column, line_texts, font_name)
+                ascent, descent = getAscentDescent(font_name, column.font_size)
+                baseline = top + (row_height - (ascent - descent)) / 2 - descent
+                if current_font != (font_name, column.font_size):
+                    text_object.setFont(font_name, column.font_size)
+                    current_font = (font_name, column.font_size)
+                if current_color != column.text_color:
+                    text_object.setFillColor(column.text_color)
+                    current_color = column.text_color
+
+                code = self.get_text_code(text_object, font_name, line_texts)
+                if column.align == 'RIGHT':
+                    right = x + column.width - self.padding
+                    positions = [right - width for width in widths]
+                elif column.align in ('CENTER', 'CENTRE'):
+                    centre = x + column.width / 2
+                    positions = [centre - width / 2 for width in widths]
+                else:
+                    positions = [x + self.padding] * len(widths)
+                text_object._code.extend(['1 0 0 1 %.2f %.2f Tm %s' % (text_x, baseline - (row + 1) * row_height,
+                                                                         text_code)
+                                          for row, (text_x, text_code, text) in enumerate(zip(positions, code,
+                                                                                              line_texts))
+                                          if text])
+            x += column.width
+        canv.drawText(text_object)
+
+        y = self.height - header_height
+        row_lines = [(0, y - row * row_height, self.width, y - row * row_height)
+                     for row in range(0 if header_height else 1, len(rows))]
+        if self.row_line is not None and row_lines:
+            weight, color = self.row_line
+            canv.setLineWidth(weight)
+            canv.setStrokeColor(color)
+            canv.lines(row_lines)
+        if self.box is not None:
+            weight, color = self.box
+            canv.setLineWidth(weight)
+            canv.setStrokeColor(color)
+            canv.rect(0, 0, self.width, self.height, stroke=1, fill=0)
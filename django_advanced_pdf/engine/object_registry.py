@@ -0,0 +1,81 @@
+import copy
+import threading
+
+from reportlab.platypus import Flowable
+
+
+class ObjectRegistry(object):
+    """
+    The objects templates refer to with <obj id="key"/>, registered once for the process (object_registry) or for a
+    batch of documents rather than pickled into the xml.
+    An object can be registered as a callable that builds it, which is only called the first time a template refers
+    to its key. Each reference gets a shallow copy of the object, so the same object can be laid out and drawn in
+    several places (and documents) at once.
+    """
+
+    def __init__(self, object_type=Flowable):
+        self.object_type = object_type
+        self._objects = {}
+        self._builders = {}
+        self._lock = threading.Lock()
+
+    def register(self, key, report_object=None, builder=None, wrap=None):
+        """
+        @type   key : str
+        @param  key : the id templates refer to the object by
+        @param  report_object : the object, or None if builder is given
+        @type   builder : callable
+        @param  builder : called with no arguments to build the object the first time it's used
+        @type   wrap : tuple
+        @param  wrap : (available width, available height) to wrap the object at once it's built, so the copies
+                       handed out start with their layout worked out
+        """
+        if (report_object is None) == (builder is None):
+            raise ValueError('Register either an object or a builder for %s' % key)
+        with self._lock:
+            self._objects.pop(key, None)
+            self._builders.pop(key, None)
+            if builder is None:
+                self._objects[key] = self._prepare(key, report_object, wrap)
+            else:
+                self._builders[key] = builder, wrap
+
+    def unregister(self, key):
+        with self._lock:
+            self._objects.pop(key, None)
+            self._builders.pop(key, None)
+
+    def _prepare(self, key, report_object, wrap):
+        if not isinstance(report_object, self.object_type):
+            raise TypeError('Object %s is a %s not a %s' % (key, type(report_object).__name__,
+                                                            self.object_type.__name__))
+        if wrap is not None:
+            report_object.wrap(*wrap)
+        return report_object
+
+    def _get(self, key):
+        with self._lock:
+            report_object = self._objects.get(key)
+            if report_object is None and key in self._builders:
+                builder, wrap = self._builders.pop(key)
+                report_object = self._objects[key] = self._prepare(key, builder(), wrap)
+        return report_object
+
+    def __contains__(self, key):
+        return key in self._objects or key in self._builders
+
+    def __getitem__(self, key):
+        report_object = self._get(key)
+        if report_object is None:
+            raise KeyError(key)
+        return copy.copy(report_object)
+
+    def get(self, key, default=None):
+        report_object = self._get(key)
+        return default if report_object is None else copy.copy(report_object)
+
+    def keys(self):
+        return set(self._objects) | set(self._builders)
+
+
+object_registry = ObjectRegistry()
@@ -1,16 +1,232 @@
 import base64
+import hashlib
+import math
 import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
 
+from PIL import Image as PILImage
 from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
 from reportlab.platypus import Image
 from io import BytesIO  # for Python 3
 
-from django_advanced_pdf.engine.utils import get_boolean_value
+from django_advanced_pdf.engine.utils import ReportXMLError, get_boolean_value
 
+# the most the decoded images kept between renders can take up
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+# the quality downsampled photos are saved at
+JPEG_QUALITY = 85
 
-def insert_image(tag):
-    image_data = BytesIO(base64.b64decode(tag.text))
-    image = Image(image_data)
+
+class SharedImageReader(object):
+    """
+    An ImageReader shared by every image with the same content. reportlab names an ImageReader by an md5 of its pixel
+    data every time it's drawn, whereas anything else is named from str(), which here is the content hash. Either
+    way the image is embedded once in each document.
+    """
+
+    def __init__(self, image_reader, key):
+        self._image_reader = image_reader
+        self.key = key
+        self._load_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._image_reader, name)
+
+    def __str__(self):
+        return 'image:' + self.key
+
+    def load(self):
+        """
+        Decodes the pixel data (and any transparency mask) now rather than when the image is first drawn, as the reader
+        is shared by renders running on other threads and PIL images can't be decoded by several threads at once.
+        JPEGs are embedded as they are so aren't decoded.
+        """
+        with self._load_lock:
+            if getattr(self._image_reader._image, 'format', None) != 'JPEG':
+                self._image_reader.getRGBData()
+                mask = getattr(self._image_reader, '_dataA', None)
+                if mask is not None:
+                    mask.getRGBData()
+
+    def jpeg_fh(self):
+        # a copy of the data as the reader's own file could be being read by another render
+        if getattr(self._image_reader._image, 'format', None) != 'JPEG':
+            return None
+        return BytesIO(self._image_reader.fp.getvalue())
+
+
+class ImageCache(object):
+    """
+    The decoded images used recently, keyed by a hash of their content and dropped least recently used first once
+    they take up more than max_bytes (the encoded data plus the pixel data it's decoded to).
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_reader(self, image_data):
+        return self._get(hashlib.sha1(image_data).hexdigest(), lambda: image_data)
+
+    def get_file_reader(self, path_key, modified, read_data):
+        """
+        Returns the image read by read_data, kept by path_key (where it's read from) and its modified time so it's only
+        read again once it changes. Without a modified time it's read every time and kept by its content.
+        """
+        if modified is None:
+            return self.get_reader(read_data())
+        return self._get('%s@%s' % (path_key, modified), read_data)
+
+    def get_scaled_reader(self, image_reader, size):
+        """
+        Returns the image downsampled to size (width, height) in pixels, kept by the original's hash and the size.
+        The original is opened again for each size as its decoded image is shared by every thread using the reader.
+        """
+        return self._get('%s:%dx%d' % ((image_reader.key,) + tuple(size)),
+                         lambda: scale_image_data(PILImage.open(BytesIO(image_reader.fp.getvalue())), size))
+
+    def _get(self, key, get_image_data):
+        with self._lock:
+            entry = self._readers.get(key)
+            if entry is not None:
+                self._readers.move_to_end(key)
+                return entry[0]
+
+        image_data = get_image_data()
+        image_reader = SharedImageReader(ImageReader(BytesIO(image_data)), key)
+        image_reader.load()
+        width, height = image_reader.getSize()
+        size = len(image_data) + width * height * len(image_reader._image.getbands())
+        with self._lock:
+            entry = self._readers.get(key)
+            if entry is not None:
+                return entry[0]
+            if size <= self.max_bytes:
+                self._readers[key] = (image_reader, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, (_, dropped_size) = self._readers.popitem(last=False)
+                    self.size -= dropped_size
+        return image_reader
+
+    def clear(self):
+        with self._lock:
+            self._readers.clear()
+            self.size = 0
+
+
+image_cache = ImageCache()
+
+
+def scale_image_data(image, size):
+    """
+    Returns the image resized to size as a JPEG if it's a photo, otherwise as a PNG (which reportlab compresses with
+    Flate) so images with transparency or only a few colours, like logos, keep their sharp edges.
+    """
+    transparent = 'A' in image.getbands() or 'transparency' in image.info
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if transparent else 'RGB')
+    image = image.resize(size, PILImage.LANCZOS)
+    image_data = BytesIO()
+    if transparent or image.getcolors(256) is not None:
+        image.save(image_data, 'PNG', optimize=True)
+    else:
+        image.save(image_data, 'JPEG', quality=JPEG_QUALITY)
+    return image_data.getvalue()
+
+
+class CachedImage(Image):
+    """
+    An image drawn from a SharedImageReader, so it's only decoded once however many times it's used.
+    """
+
+    def __init__(self, image_reader):
+        self._img = image_reader
+        Image.__init__(self, image_reader.fp)
+
+    def limit_dpi(self, max_dpi):
+        """
+        Swaps the image for one downsampled to max_dpi at the size it's drawn, if it has more pixels than that.
+        """
+        image_width, image_height = self._img.getSize()
+        size = (min(image_width, max(1, math.ceil(self.drawWidth * max_dpi / 72))),
+                min(image_height, max(1, math.ceil(self.drawHeight * max_dpi / 72))))
+        if size != (image_width, image_height):
+            self._img = image_cache.get_scaled_reader(self._img, size)
+
+
+def get_storage_reader(path, storage=None):
+    if storage is None:
+        from django.core.files.storage import default_storage
+        storage = default_storage
+    try:
+        modified = storage.get_modified_time(path).timestamp()
+    except NotImplementedError:
+        modified = None
+
+    def read_data():
+        with storage.open(path, 'rb') as image_file:
+            return image_file.read()
+    storage_name = getattr(storage, 'location', None) or type(storage).__name__
+    return image_cache.get_file_reader('storage:%s:%s' % (storage_name, path), modified, read_data)
+
+
+def get_local_file_reader(path, root):
+    if root is None:
+        raise ReportXMLError('No image root set for %s' % path)
+    root = Path(root).resolve()
+    file_path = Path(root, path).resolve()
+    if root not in file_path.parents:
+        raise ReportXMLError('Image %s is outside the image root' % path)
+    return image_cache.get_file_reader('file:%s' % file_path, file_path.stat().st_mtime_ns, file_path.read_bytes)
+
+
+def get_image_reader(tag, storage=None, root=None):
+    """
+    Returns the reader for a png tag's image, which is either the tag's text in base64 or read from its src, either
+    "storage:path" for a file in Django's storage (storage or the default storage) or "file:path" for a file under
+    root, so the image doesn't have to go through the template and the xml.
+    """
+    src = tag.get('src')
+    if src is None:
+        return image_cache.get_reader(base64.b64decode(tag.text))
+    source, _, path = src.partition(':')
+    if source == 'storage':
+        return get_storage_reader(path, storage)
+    if source == 'file':
+        return get_local_file_reader(path, root)
+    raise ReportXMLError('Unknown image src %s' % src)
+
+
+class ImageTag(object):
+    """
+    The text and attributes of a png tag, read from the xml in the thread processing it, so the image can be made in
+    another thread.
+    """
+
+    def __init__(self, tag):
+        self.text = tag.text
+        self.attrib = dict(tag.attrib)
+
+    def get(self, name, default=None):
+        return self.attrib.get(name, default)
+
+
+def prefetch_image(tag, max_dpi=None, storage=None, root=None):
+    """
+    insert_image for an ImageTag run in a thread pool while the xml is processed, so the image is read and decoded
+    (by the image cache) before it's needed.
+    """
+    return insert_image(tag, max_dpi=max_dpi, storage=storage, root=root)
+
+
+def insert_image(tag, max_dpi=None, storage=None, root=None):
+    image = CachedImage(get_image_reader(tag, storage, root))
 
     orig_width, orig_height = image.imageWidth, image.imageHeight
     aspect = orig_width / float(orig_height)
@@ -54,6 +270,9 @@ def insert_image(tag):
             image.drawWidth = (float(height_attr) * aspect) * mm
         # else: keep original
 
+    max_dpi = tag.get('max_dpi', max_dpi)
+    if max_dpi:
+        image.limit_dpi(float(max_dpi))
     return image
 
 
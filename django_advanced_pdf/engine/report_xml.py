@@ -1,5 +1,6 @@
 import copy
 import re
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO, BytesIO
 
 from lxml import etree
@@ -8,17 +9,24 @@ from reportlab.lib.units import mm
 from reportlab.platypus import TableStyle, PageBreak, Spacer, Table
 from svglib.svglib import SvgRenderer
 
+from .cell_markup import markup_prefix, split_cell_markup
+from .column_widths import AUTO_WIDTH_TEXT_TAGS, ColumnMeasure, sample_rows, solve_column_widths
+from .enhanced_paragraph.deferred_paragraph import DeferredParagraph
 from .enhanced_paragraph.enhanced_paragraph import EnhancedParagraph
 from .enhanced_paragraph.style import EnhancedParagraphStyle
 from .enhanced_table.data import EnhancedTableData
+from .enhanced_table.row_variables import TableVariables
+from .enhanced_table.table_chunks import DEFAULT_CHUNK_ROWS, chunk_table
+from .grid.grid import Grid, GridColumn
+from .object_registry import object_registry
 from .enhanced_table.enhanced_tables import OVERFLOW_ROW, EnhancedTable, HEADER_FOOTER, KEEP_TYPE_END, KEEP_TYPE_START, \
     KEEP_TYPE_MIDDLE, KEEP_TYPE_SPAN, KEEP_TYPE_NA
-from .png_images import insert_image, insert_obj
+from .png_images import ImageTag, insert_image, insert_obj, prefetch_image
 from django_advanced_pdf.engine.svg_tools.svg_ruler import SVGScaledRuler
 from django_advanced_pdf.engine.svg_tools.svg_scaler import SVGScaler
 from .svg_tools.svg_scaled_renderer import SvgScaledRenderer
 from .utils import DocTemplate, get_page_size_from_element, intcomma_currency, ColumnWidthPercentage, \
-    MyTDUserHtmlParser, \
+    ColumnWidths, MyTDUserHtmlParser, \
     get_boolean_value, ReportXMLError, ObjectPosition
 from ..pagers.base import BasePager
 from ..pagers.border import BorderPager
@@ -63,12 +71,17 @@ class ReportXML(object):
         (u'rsquo', u'’'),
     ]
 
-    def __init__(self, object_lookup=None, pager_kwargs=None, test_mode=False, status_method=None):
+    def __init__(self, object_lookup=None, pager_kwargs=None, test_mode=False, status_method=None,
+                 release_memory=False, image_storage=None, image_root=None, image_workers=0,
+                 allow_pickled_objects=True):
         self.styles = {}
         if object_lookup is not None:
             self.object_lookup = object_lookup
         else:
-            self.object_lookup = {}
+            self.object_lookup = object_registry
+        self.built_objects = {}
+        self.allow_pickled_objects = allow_pickled_objects
+        self.pickled_objects = {}
         self.background_image_first = None
         self.background_image_remaining = None
         self.background_image_footer = None
@@ -85,8 +98,17 @@ class ReportXML(object):
         self.root_element = 0
         self.page_style = None
         self.test_mode = test_mode
+        self.release_memory = release_memory
+        self.max_dpi = None
+        # where <png src="storage:..."/> and <png src="file:..."/> images are read from
+        self.image_storage = image_storage
+        self.image_root = image_root
+        # the threads the images are made in while the xml is processed (0 to make them as they're reached)
+        self.image_workers = image_workers
+        self.image_futures = {}
         self.status_method = status_method
         self.held_variables = None
+        self.nested_tables = {}
         self.has_potential_xml_errors = False
         self.pager_blocks = []
 
@@ -138,17 +160,14 @@ class ReportXML(object):
         display_object = None
         object_id = element.get('id', "")
         if object_id != "":
-            if object_id in self.object_lookup.keys():
-                display_object = self.object_lookup[object_id]
-            else:
+            display_object = self.lookup_object(object_id)
+            if display_object is None:
                 try:
-                    object_id = int(object_id)
-                    if object_id in self.object_lookup.keys():
-                        display_object = self.object_lookup[object_id]
+                    display_object = self.lookup_object(int(object_id))
                 except ValueError:
                     pass
         else:
-            display_object = insert_obj(element)
+            display_object = self.get_pickled_object(element)
         if page_height is not None and page_width is not None:
             return self.set_object_position(element=element,
                                             display_object=display_object,
@@ -158,6 +177,32 @@ class ReportXML(object):
                                             bottom_border=bottom_border)
         return display_object
 
+    def lookup_object(self, object_id):
+        """
+        Returns the object for an id from object_lookup, which is either a dict (or ObjectRegistry) of the objects or a
+        callable returning the object for an id (or None), so only the objects the template refers to are built.
+        """
+        if callable(self.object_lookup):
+            if object_id not in self.built_objects:
+                self.built_objects[object_id] = self.object_lookup(object_id)
+            # a copy for each reference, as the registry hands out
+            return copy.copy(self.built_objects[object_id])
+        if object_id in self.object_lookup:
+            return self.object_lookup[object_id]
+        return None
+
+    def get_pickled_object(self, element):
+        """
+        Returns the object pickled into an obj tag, unpickling each one once per document. Unpickling can run any code
+        so templates that aren't trusted should be made with allow_pickled_objects off and refer to registered objects
+        by id.
+        """
+        if not self.allow_pickled_objects:
+            raise ReportXMLError('Pickled objects are not allowed')
+        if element.text not in self.pickled_objects:
+            self.pickled_objects[element.text] = insert_obj(element)
+        return copy.copy(self.pickled_objects[element.text])
+
     def set_object_position(self, element, display_object, page_height, page_width, top_border, bottom_border):
         pos_x = element.get('pos_x', '')
         pos_y = element.get('pos_y', '')
@@ -284,48 +329,98 @@ class ReportXML(object):
                               test_mode=self.test_mode,
                               status_method=self.update_status,
                               root_element=self.root_element,
+                              release_memory=self.release_memory,
                               **self.pager_kwargs,
                               **kwargs)
 
     def process_xml(self, root_element, story, page_width, page_height, top_border, bottom_border):
         self.styles = {}
+        self.nested_tables = {}
+        self.max_dpi = root_element.get('max_dpi')
         children = root_element.getchildren()
 
-        for child in children:
-            current_tag = child.tag.lower()
-            if current_tag == "table":
-                table = self.process_table(child,
-                                           table_width=page_width,
-                                           page_height=page_height,
-                                           page_width=page_width,
-                                           top_border=top_border,
-                                           bottom_border=bottom_border)
-                if table is not None:
-                    story.append(table)
-
-            elif current_tag == "style":
-                self.process_style_element(child.text)
-            elif current_tag == "p":
-                story.append(self.process_paragraph_element(child))
-            elif current_tag == "page_break":
-                story.append(PageBreak())
-            elif current_tag == "spacer":
-                story.append(self.process_spacer_tag(child))
-            elif current_tag == "obj":
-
-                story.append(self.get_object(element=child,
-                                             page_height=page_height,
-                                             page_width=page_width,
-                                             top_border=top_border,
-                                             bottom_border=bottom_border))
-            elif current_tag == "pagers":
-                self.process_pagers(element=child,
-                                    page_width=page_width,
-                                    page_height=page_height)
+        executor = self.prefetch_images(root_element)
+        try:
+            for child in children:
+                current_tag = child.tag.lower()
+                if current_tag == "table":
+                    table = self.process_table(child,
+                                               table_width=page_width,
+                                               page_height=page_height,
+                                               page_width=page_width,
+                                               top_border=top_border,
+                                               bottom_border=bottom_border,
+                                               allow_chunks=True)
+                    if table is not None:
+                        story.append(table)
+
+                elif current_tag == "grid":
+                    story.append(self.process_grid(child, table_width=page_width))
+                elif current_tag == "style":
+                    self.process_style_element(child.text)
+                elif current_tag == "p":
+                    story.append(self.process_paragraph_element(child))
+                elif current_tag == "page_break":
+                    story.append(PageBreak())
+                elif current_tag == "spacer":
+                    story.append(self.process_spacer_tag(child))
+                elif current_tag == "obj":
+
+                    story.append(self.get_object(element=child,
+                                                 page_height=page_height,
+                                                 page_width=page_width,
+                                                 top_border=top_border,
+                                                 bottom_border=bottom_border))
+                elif current_tag == "pagers":
+                    self.process_pagers(element=child,
+                                        page_width=page_width,
+                                        page_height=page_height)
+        finally:
+            if executor is not None:
+                # the images that weren't used (in hidden columns for instance) aren't needed, nor are their errors
+                executor.shutdown(cancel_futures=True)
+            self.image_futures = {}
 
         if len(story) == 0:
             raise ReportXMLError("No data")
 
+    def prefetch_images(self, root_element):
+        """
+        Starts making the images for the png tags in a thread pool of image_workers threads, so they're decoded while
+        the rest of the xml is processed, and returns the pool (None if image_workers isn't set).
+        """
+        if not self.image_workers:
+            return None
+        executor = ThreadPoolExecutor(max_workers=self.image_workers)
+        for element in root_element.iter():
+            parent = element.getparent()
+            if (isinstance(element.tag, str) and element.tag[-3:] == 'png' and
+                    parent is not None and parent.tag[-2:] == 'td' and parent[0] is element and
+                    not self.is_hidden_cell(parent)):
+                self.image_futures[element] = executor.submit(prefetch_image, ImageTag(element),
+                                                              max_dpi=self.max_dpi,
+                                                              storage=self.image_storage,
+                                                              root=self.image_root)
+        return executor
+
+    @staticmethod
+    def is_hidden_cell(td_element):
+        """
+        True if a td is hidden by itself or by its row or table. Columns hidden by other rows aren't known until the
+        table is processed, so images in them are cancelled once the xml has been processed instead.
+        """
+        if (td_element.get('hidden') or get_boolean_value(td_element.get('hidden_column')) or
+                not get_boolean_value(td_element.get('show_column'), default=True)):
+            return True
+        return any(element.tag in ('tr', 'table') and get_boolean_value(element.get('hidden'))
+                   for element in td_element.iterancestors())
+
+    def get_image(self, element):
+        future = self.image_futures.pop(element, None)
+        if future is not None:
+            return future.result()
+        return insert_image(element, max_dpi=self.max_dpi, storage=self.image_storage, root=self.image_root)
+
     def process_style_element(self, style_text):
         """
         This implement the style element just like CSS in html does
@@ -336,8 +431,10 @@ class ReportXML(object):
             style_css = match.group(2)
             style_css = style_css.strip(" \r\n")
             self.styles[style_name] = style_css
+        self.nested_tables = {}
 
-    def process_table(self, table, table_width, page_height=None, page_width=None, top_border=None, bottom_border=None):
+    def process_table(self, table, table_width, page_height=None, page_width=None, top_border=None, bottom_border=None,
+                      allow_chunks=False):
         """
         This implements tables using EnhanceTable
         :param page_height:
@@ -346,6 +443,7 @@ class ReportXML(object):
         :param table_width:
         :param top_border:
         :param bottom_border:
+        :param allow_chunks: long tables in the story are laid out a chunk of rows at a time (see ChunkedTable)
         """
         main_data = []
         main_styles = []
@@ -363,6 +461,7 @@ class ReportXML(object):
         keep_data = []
         other_styles = {}
         held_cells = {}
+        split_rows = {}
 
         self.process_css_for_table(table, main_styles, other_styles)
 
@@ -373,23 +472,28 @@ class ReportXML(object):
         min_rows_bottom = int(table.get('min_rows_bottom', 0))
 
         rows_variables = []
-        variables = {}
+        variables = TableVariables()
         if self.held_variables is not None:
-            variables = {**self.held_variables}
+            variables.update(self.held_variables)
 
         row_count = -1
-        col_widths = []
+        col_widths = ColumnWidths()
 
         layout_widths = table.get('layout_widths')
-        if layout_widths is not None:
+        auto_widths = layout_widths == 'auto'
+        if layout_widths is not None and not auto_widths:
             for col_width in layout_widths.split(','):
                 col_widths.append(self.set_column_width(col_width))
 
         pos_x = table.get('pos_x')
         pos_y = table.get('pos_y')
+        deferred_cells = get_boolean_value(table.get('deferred_cells'))
 
         held_row_span = 1
         hidden_columns = set()
+        self.process_table_schema(table, col_widths, hidden_columns)
+        if auto_widths:
+            self.process_auto_column_widths(table, col_widths, hidden_columns, table_width)
 
         for element in table:
             if element.tag == 'tr':
@@ -406,7 +510,9 @@ class ReportXML(object):
                                                                    col_widths=col_widths,
                                                                    table_width=table_width,
                                                                    hidden_columns=hidden_columns,
-                                                                   held_cells=held_cells)
+                                                                   held_cells=held_cells,
+                                                                   deferred_cells=deferred_cells,
+                                                                   split_rows=split_rows)
 
                 if max_row_span > held_row_span:
                     held_row_span = max_row_span
@@ -441,7 +547,9 @@ class ReportXML(object):
                                                                            col_widths=col_widths,
                                                                            table_width=table_width,
                                                                            hidden_columns=hidden_columns,
-                                                                           held_cells=held_cells)
+                                                                           held_cells=held_cells,
+                                                                           deferred_cells=deferred_cells,
+                                                                           split_rows=split_rows)
                         if max_row_span > held_row_span:
                             held_row_span = max_row_span
                         if held_row_span > 1 or min_rows_top > 0:
@@ -526,11 +634,13 @@ class ReportXML(object):
 
         h_align, v_align = self.get_alignment_details(main_styles)
 
-        new_column_widths = self.process_column_widths(col_widths, table_width)
+        new_column_widths = col_widths.resolve(table_width, self.process_column_widths)
 
         if main_data:
             t = EnhancedTable(table_data={'row_data': main_data,
                                           'row_variables': rows_variables,
+                                          'row_properties': [{'split_in_row': split_rows[row]} if row in split_rows
+                                                             else {} for row in range(len(main_data))],
                                           'keep_with_next': keep_data,
                                           'headers_index': headers_index,
                                           'footers_index': footers_index},
@@ -544,7 +654,7 @@ class ReportXML(object):
                               initial=True)
 
             if len(rows_variables) > 0 and len(rows_variables[-1]) > 0:
-                self.held_variables = rows_variables[-1]
+                self.held_variables = dict(rows_variables[-1])
             else:
                 self.held_variables = None
         else:
@@ -576,9 +686,29 @@ class ReportXML(object):
             else:
                 new_pos_x = pos_x
             t.pos_x = str(new_pos_x)
+        elif allow_chunks:
+            chunk_rows = table.get('chunk_rows', 'auto')
+            t = chunk_table(t, DEFAULT_CHUNK_ROWS if chunk_rows == 'auto' else int(chunk_rows))
 
         return t
 
+    def process_nested_table(self, table, table_width):
+        """
+        Nested tables are often the same on many rows (e.g. an options table on every line of a quote), so the table
+        made for each one is kept and used again. Tables are keyed on their xml, width and the variables held from the
+        previous table, as those are all that process_table works from apart from the styles (the cache is cleared
+        when they change).
+        """
+        held_variables = self.held_variables
+        key = (etree.tostring(table), table_width,
+               tuple(sorted(held_variables.items())) if held_variables is not None else None)
+        try:
+            nested_table, self.held_variables = self.nested_tables[key]
+        except KeyError:
+            nested_table = self.process_table(table, table_width)
+            self.nested_tables[key] = nested_table, self.held_variables
+        return nested_table
+
     @staticmethod
     def coord(x, y):
         """
@@ -590,7 +720,8 @@ class ReportXML(object):
 
     def process_tr(self, tr_element, data, styles, other_table_styles,
                    row_heights, row_count, span, rows_variables, variables, col_widths, table_width, hidden_columns,
-                   held_cells=None, default_row_height=None, is_header_or_footer=False):
+                   held_cells=None, default_row_height=None, is_header_or_footer=False, deferred_cells=False,
+                   split_rows=None):
 
         max_row_span = 0
         if get_boolean_value(tr_element.get('hidden')):
@@ -606,7 +737,7 @@ class ReportXML(object):
         overflow_rows = []
         overflow_row_count = 0
 
-        row_variables = copy.copy(variables)
+        row_variables = variables.new_row()
         for variables_element in tr_element.iter('variables'):
             for variable in variables_element.attrib:
                 value = variables_element.get(variable)
@@ -662,43 +793,20 @@ class ReportXML(object):
         col_count = 0
         overflow_ccs_elements = []
         overflow_elements = []
-        index = -1
-        for td_element in tr_element:
-
-            if td_element.tag != 'td':
-                continue
-            index += 1
-            name = td_element.get('name')
-            if name is not None and name in hidden_columns:
-                continue
-            if index in hidden_columns:
-                continue
-
-            hidden_column = td_element.get('hidden_column')
-            show_column = td_element.get('show_column')
+        for index, td_element in self.visible_cells(tr_element, hidden_columns):
             col_span = int(td_element.get('colspan', "1"))
             row_span = int(td_element.get('rowspan', "1"))
 
-            if get_boolean_value(hidden_column) or not get_boolean_value(show_column, default=True):
-                if name is not None:
-                    hidden_columns.add(name)
-                else:
-                    for h_index in range(col_span):
-                        hidden_columns.add(index + h_index)
-                continue
-            if td_element.get('hidden'):
-                continue
-
             if len(col_widths) < col_count + 1:
                 col_widths.append(None)
 
             # check that cell is not marked as a rowspan
-            p_offset = span.get('%d-%d' % (row_count, col_count + offset), None)
+            p_offset = span.get((row_count, col_count + offset))
             while p_offset is not None and p_offset > 0:
                 for x in range(0, p_offset):
                     row_data.append('')
                 offset += p_offset
-                p_offset = span.get('%d-%d' % (row_count, col_count + offset), None)
+                p_offset = span.get((row_count, col_count + offset))
 
             if row_span > max_row_span:
                 max_row_span = row_span
@@ -715,7 +823,7 @@ class ReportXML(object):
             user_html = get_boolean_value(td_element.get('user_html'))
 
             if len(td_element) > 0 and td_element[0].tag == 'table':
-                new_table_column_widths = self.process_column_widths(col_widths, table_width)
+                new_table_column_widths = col_widths.resolve(table_width, self.process_column_widths)
                 new_table_column_width = 0
                 new_table_column_widths_count = len(new_table_column_widths)
                 if index < new_table_column_widths_count:
@@ -734,7 +842,7 @@ class ReportXML(object):
                                                         start_row=row_count,
                                                         end_col=-col_count + offset + col_span - 1,
                                                         end_row=-row_count + row_span - 1) / mm)
-                display_object = self.process_table(td_element[0], new_table_column_width - padding)
+                display_object = self.process_nested_table(td_element[0], new_table_column_width - padding)
                 if display_object is None:
                     display_object = ''
             elif len(td_element) > 0 and td_element[0].tag[-3:] == 'svg':
@@ -779,7 +887,7 @@ class ReportXML(object):
                                                         height=scaled_height,
                                                         units=units)
             elif len(td_element) > 0 and td_element[0].tag[-3:] == 'png':
-                display_object = insert_image(td_element[0])
+                display_object = self.get_image(td_element[0])
             elif len(td_element) > 0 and td_element[0].tag[-3:] == 'obj':
                 display_object = self.get_object(element=td_element[0])
             elif len(td_element) > 0 and td_element[0].tag[-12:] == 'currency_qty':
@@ -866,7 +974,13 @@ class ReportXML(object):
                                                                    row_count=row_count,
                                                                    col_count=col_count + offset)
 
-                if overflow_gt_height is not None:
+                if split_rows is not None and get_boolean_value(td_element.get('overflow_split')):
+                    # the row is split across pages by the table rather than into overflow rows
+                    self.add_split_row_commands(split_rows, tr_element, td_element, row_count,
+                                                start_col=col_count + offset,
+                                                end_col=col_count + offset + col_span - 1)
+                    display_object = EnhancedParagraph(xml, style, css_classes=self.styles, incremental_split=True)
+                elif overflow_gt_height is not None:
 
                     display_object, overflow_row_count = self.process_overflow_height(
                         td_element=td_element,
@@ -911,6 +1025,8 @@ class ReportXML(object):
                         overflow_elements.append(td_element)
                     
                     display_object = EnhancedParagraph(out_xml, style, css_classes=self.styles)
+                elif deferred_cells and td_element.get('hold_cell') is None:
+                    display_object = DeferredParagraph(xml, style, css_classes=self.styles)
                 else:
                     display_object = EnhancedParagraph(xml, style, css_classes=self.styles)
 
@@ -921,7 +1037,8 @@ class ReportXML(object):
 
             hold_cell = td_element.get('hold_cell')
             if hold_cell is not None:
-                held_cells[hold_cell] = {'display_object': display_object, 'index': index, 'colspan': col_span}
+                held_cells[hold_cell] = {'display_object': display_object, 'index': index, 'colspan': col_span,
+                                         'heights': {}}
             row_data.append(display_object)
 
             width = self.set_column_width(td_element.get('width'))
@@ -941,7 +1058,7 @@ class ReportXML(object):
 
                 if row_span > 1:
                     for r in range(1, row_span):
-                        span['%d-%d' % (r + row_count + overflow_row_count, col_count + offset)] = col_span
+                        span[(r + row_count + overflow_row_count, col_count + offset)] = col_span
                 offset += col_span - 1
             col_count += 1
 
@@ -983,6 +1100,131 @@ class ReportXML(object):
 
         return max_row_span, overflow_row_count
 
+    @staticmethod
+    def visible_cells(tr_element, hidden_columns):
+        """
+        Yields (index, td_element) for each td in the row that is shown, adding any columns the row hides to
+        hidden_columns
+        """
+        index = -1
+        for td_element in tr_element:
+
+            if td_element.tag != 'td':
+                continue
+            index += 1
+            name = td_element.get('name')
+            if name is not None and name in hidden_columns:
+                continue
+            if index in hidden_columns:
+                continue
+
+            hidden_column = td_element.get('hidden_column')
+            show_column = td_element.get('show_column')
+
+            if get_boolean_value(hidden_column) or not get_boolean_value(show_column, default=True):
+                if name is not None:
+                    hidden_columns.add(name)
+                else:
+                    for h_index in range(int(td_element.get('colspan', "1"))):
+                        hidden_columns.add(index + h_index)
+                continue
+            if td_element.get('hidden'):
+                continue
+            yield index, td_element
+
+    @staticmethod
+    def table_rows(table):
+        """
+        Yields the table's own rows (including those in keep, header and footer elements but not those of any nested
+        tables) in the order they are processed
+        """
+        for element in table:
+            if element.tag == 'tr':
+                yield element
+            elif element.tag in ('keep', 'header', 'footer'):
+                for tr_element in element:
+                    if tr_element.tag == 'tr':
+                        yield tr_element
+
+    def process_table_schema(self, table, col_widths, hidden_columns):
+        """
+        Works out the table's columns before any rows are processed: which columns are hidden and the widths set on
+        the cells. Everything that depends on the column widths (nested tables, svgs, overflow cells) then sees the
+        same widths as the finished table, whichever row it is in.
+        """
+        for tr_element in self.table_rows(table):
+            if get_boolean_value(tr_element.get('hidden')):
+                continue
+            for col_count, (_, td_element) in enumerate(self.visible_cells(tr_element, hidden_columns)):
+                if len(col_widths) < col_count + 1:
+                    col_widths.append(None)
+                width = self.set_column_width(td_element.get('width'))
+                if width is not None:
+                    col_widths[col_count] = width
+
+    def process_auto_column_widths(self, table, col_widths, hidden_columns, table_width):
+        """
+        For layout_widths="auto": the columns that haven't been given a width are sized to their content. A sample of
+        the rows is measured to find the narrowest (widest word) and preferred (widest line) width of each column and
+        the space left is shared out between them, see solve_column_widths. Columns holding anything other than text
+        (nested tables, images etc) keep an equal share of the space.
+        """
+        auto_columns = [index for index, width in enumerate(col_widths) if width is None]
+        if not auto_columns:
+            return
+        measures = {index: ColumnMeasure() for index in auto_columns}
+        table_css = self.get_css_values(table)
+        rows = [tr_element for tr_element in self.table_rows(table) if not get_boolean_value(tr_element.get('hidden'))]
+        for tr_element in sample_rows(rows):
+            row_css = {**table_css, **self.get_css_values(tr_element)}
+            for col_count, (_, td_element) in enumerate(self.visible_cells(tr_element, hidden_columns)):
+                measure = measures.get(col_count)
+                if measure is None or td_element.get('colspan', '1') != '1':
+                    continue
+                if any(isinstance(child.tag, str) and child.tag not in AUTO_WIDTH_TEXT_TAGS for child in td_element):
+                    continue
+                css = {**row_css, **self.get_css_values(td_element)}
+                padding = (float(css.get('left_padding', 6 / mm)) + float(css.get('right_padding', 6 / mm))) * mm
+                measure.add_cell(lines=self.get_cell_lines(td_element),
+                                 font_name=css.get('font', css.get('font_name', css.get('face', 'Helvetica'))),
+                                 font_size=float(css.get('size', css.get('font_size', 10))),
+                                 padding=padding)
+
+        measured = {}
+        for index, measure in measures.items():
+            minimum, preferred = measure.measure()
+            if preferred > 0:
+                measured[index] = minimum, preferred
+        if not measured:
+            return
+
+        defined_space = sum(width for width in col_widths
+                            if width is not None and not isinstance(width, ColumnWidthPercentage))
+        defined_percentage = sum(width.get_value() for width in col_widths if isinstance(width, ColumnWidthPercentage))
+        available = max(table_width - defined_space, 0) * (100 - defined_percentage) / 100.0
+        available = available * len(measured) / len(auto_columns) * mm
+
+        indexes = sorted(measured)
+        widths = solve_column_widths(minimum_widths=[measured[index][0] for index in indexes],
+                                     preferred_widths=[measured[index][1] for index in indexes],
+                                     available=available)
+        for index, width in zip(indexes, widths):
+            col_widths[index] = width / mm
+
+    @staticmethod
+    def get_cell_lines(element):
+        """
+        Returns the lines of text in a cell (split at any br tags) with the white space tidied up
+        """
+        def get_text(node):
+            parts = [node.text or '']
+            for child in node:
+                parts.append('\n' if child.tag == 'br' else get_text(child))
+                parts.append(child.tail or '')
+            return ''.join(parts)
+
+        return [' '.join(line.split()) for line in get_text(element).split('\n')]
+
     def repair_user_html(self, html):
         parser = MyTDUserHtmlParser()
         parser.feed(html)
@@ -1141,7 +1383,9 @@ class ReportXML(object):
         paragraph_style.process_raw_css(css)
         xml = etree.tostring(tag)
 
-        enhanced_paragraph = EnhancedParagraph(xml, paragraph_style, css_classes=self.styles)
+        enhanced_paragraph = EnhancedParagraph(xml, paragraph_style, css_classes=self.styles,
+                                               incremental_split=get_boolean_value(tag.get('incremental_split'),
+                                                                                   default=True))
         return enhanced_paragraph
 
     @staticmethod
@@ -1194,6 +1438,80 @@ class ReportXML(object):
 
         return new_col_widths
 
+    def get_css_values(self, element):
+        css = self.get_css_from_style_attribute(element)
+        css = css.replace('\r', '').replace('\n', '')
+        values = {}
+        for style in css.split(';'):
+            if style.strip() == '':
+                continue
+            style_type, style_detail = style.split(':')
+            values[style_type.lower().strip()] = style_detail.strip()
+        return values
+
+    @staticmethod
+    def get_line_setting(value):
+        if value is None:
+            return None
+        details = value.split(',')
+        if len(details) > 1:
+            return float(details[0]), HexColor(details[1])
+        return float(details[0]), black
+
+    def process_grid(self, element, table_width):
+        """
+        This implements the grid element, a fast table for large amounts of single line text (see Grid).
+        Columns are defined with column elements and the data can be supplied as tr/td elements or as a rows element
+        holding one row per line with the cells separated by the separator attribute (default "|").
+        :param element:
+        :param table_width:
+        """
+        css = self.get_css_values(element)
+        font_name = css.get('font', css.get('font_name', 'Helvetica'))
+        font_size = float(css.get('size', css.get('font_size', 8)))
+        text_color = HexColor(css['text_color']) if 'text_color' in css else black
+        header_font_name = css.get('header_font', font_name)
+
+        col_widths = []
+        columns = []
+        rows = []
+        for child in element:
+            if child.tag == 'column':
+                column_css = self.get_css_values(child)
+                col_widths.append(self.set_column_width(child.get('width')))
+                column_font_name = column_css.get('font', column_css.get('font_name', font_name))
+                columns.append(GridColumn(width=0,
+                                          title=child.text or '',
+                                          font_name=column_font_name,
+                                          font_size=float(column_css.get('size',
+                                                                         column_css.get('font_size', font_size))),
+                                          text_color=(HexColor(column_css['text_color'])
+                                                      if 'text_color' in column_css else text_color),
+                                          align=child.get('align', 'left'),
+                                          overflow=child.get('overflow', 'clip'),
+                                          header_font_name=column_css.get('header_font', header_font_name)))
+            elif child.tag == 'tr':
+                rows.append([td.text or '' for td in child if td.tag == 'td'])
+            elif child.tag == 'rows' and child.text:
+                separator = child.get('separator', '|')
+                for line in child.text.splitlines():
+                    line = line.strip()
+                    if line != '':
+                        rows.append(line.split(separator))
+
+        for column, width in zip(columns, self.process_column_widths(col_widths, table_width)):
+            column.width = width
+
+        return Grid(columns=columns,
+                    rows=rows,
+                    row_height=float(css.get('row_height', 5)) * mm,
+                    padding=float(css.get('padding', 1)) * mm,
+                    show_header=get_boolean_value(element.get('show_header'), default=True),
+                    header_background=(HexColor(css['header_background'])
+                                       if 'header_background' in css else None),
+                    row_line=self.get_line_setting(css.get('row_line')),
+                    box=self.get_line_setting(css.get('box')))
+
     def process_spacer_tag(self, element):
 
         css = self.get_css_from_style_attribute(element)
@@ -1221,120 +1539,7 @@ class ReportXML(object):
 
     @staticmethod
     def split_cell(xml, overflow_length, overflow_size):
-        overflow_rows = []
-        held_working_tags = []
-        raw_parts = None
-        offset = xml.find('>'.encode())
-        m = re.search(r"<br\s?/>".encode(), xml[overflow_length + offset:])
-        if m:
-            pos = m.start() + overflow_length + offset
-            span = m.span()
-            match_len = span[1] - span[0]
-            xml_parts = re.split(r"<br\s?/>".encode(), xml[pos + match_len:])
-            next_xml = ''
-            raw_parts = []
-            # this makes the xml valid again after it has been split
-
-            for xml_part in [xml[:pos]] + xml_parts:
-                working_xml = next_xml.encode() + xml_part
-                tags = re.findall(r'<[^<>]*>', working_xml.decode())
-                next_xml = ''
-                working_tags = []
-                for tag in tags:
-                    if tag[-2] == '/':
-                        continue
-                    m = re.search(r'\w+', tag)
-                    tag_name = m.group(0)
-
-                    if tag[1] == '/':
-                        if len(working_tags) == 0:
-                            break
-                        elif tag_name == working_tags[-1][0]:
-                            working_tags.pop()
-                            if tag_name == 'td' and len(working_tags) == 0:
-                                break
-                    else:
-                        working_tags.append((tag_name, tag))
-                raw_parts.append(xml_part)
-
-                held_working_tags.append(working_tags)
-                for tag in reversed(working_tags):
-                    working_xml += ('</' + tag[0] + '>').encode()
-                overflow_rows.append(working_xml)
-                for tag in working_tags:
-                    next_xml += tag[1]
-                
-            return overflow_rows[0], overflow_rows[1:], raw_parts, held_working_tags, False
-        else:
-            if overflow_length == 0:
-                overflow_length = overflow_size
-            overflow_rows = []
-            held_working_tags = []
-            raw_parts = []
-            
-            def find_tags(s):
-                return list(re.finditer(rb'</?(\w+)[^<>]*?>', s))
-            
-            def close_open_tags(stack):
-                return b''.join([b'</%s>' % tag[0] for tag in reversed(stack)])
-            
-            def reopen_tags(stack):
-                return b''.join([tag[1] for tag in stack])
-            
-            def find_safe_split(text, start, max_len):
-                end = int(min(start + max_len, len(text)))
-
-                chunk = text[start:end]
-                
-                # Avoid mid-tag
-                lt = chunk.rfind(b'<')
-                gt = chunk.rfind(b'>')
-                if lt > gt:
-                    end = start + lt  # Don't split in the middle of a tag
-                else:
-                    # Find last space or > within the chunk to avoid word split
-                    safe = max(chunk.rfind(b' '), chunk.rfind(b'>'))
-                    if safe != -1 and safe + start < end:
-                        end = start + safe + 1  # +1 to keep the delimiter
-                
-                return end
-            
-            open_tags = []
-            pos = 0
-            
-            while pos < len(xml):
-                end = find_safe_split(xml, pos, overflow_length)
-                if end == 0 and pos == 0:
-                    overflow_length += 1
-                    continue
-                chunk = xml[pos:end]
-                
-                tags = find_tags(chunk)
-                tag_stack = list(open_tags)
-                
-                for tag in tags:
-                    full_tag = tag.group()
-                    tag_name = tag.group(1)
-                    if full_tag.startswith(b'</'):
-                        if tag_name == open_tags[-1][0]:
-                            open_tags.pop()
-                            if tag_name == 'td' and len(open_tags) == 0:
-                                break
-                    elif not full_tag.endswith(b'/>'):
-                        open_tags.append((tag_name, full_tag))
-                
-                if chunk != '\n':
-                    raw_parts.append(chunk)
-                held_working_tags.append(tag_stack)
-                
-                closing = close_open_tags(open_tags)
-                reopening = reopen_tags(tag_stack)
-                full_chunk = reopening + chunk + closing
-                if chunk != '\n':
-                    overflow_rows.append(full_chunk)
-                pos = end
-            
-            return overflow_rows[0], overflow_rows[1:], raw_parts, held_working_tags, True
+        return split_cell_markup(xml, overflow_length, overflow_size)
 
     def overflow_cell(self, td_element, xml, overflow_gt_length, styles, style, other_styles,
                       offset, col_count, row_count, col_span,
@@ -1371,6 +1576,25 @@ class ReportXML(object):
                 style = self.process_css_for_table_paragraph_style(styles, other_styles, row_count, col_count + offset)
         return xml, style, len(overflow_rows)
 
+    def add_split_row_commands(self, split_rows, tr_element, td_element, row_count, start_col, end_col):
+        """
+        Adds a cell's overflow top, middle and bottom styles to the commands used when its row is split across pages
+        (in the row's own row numbers). The row's overflow bottom style is added with the first cell.
+        """
+        split_commands = split_rows.get(row_count)
+        if split_commands is None:
+            split_commands = split_rows[row_count] = {'top': [], 'middle': [], 'bottom': []}
+            self.process_css_for_table(tr_element, split_commands['bottom'], {}, start_row=0, end_row=0,
+                                       style_tag_name='overflow_bottom_style', class_tag_name='overflow_bottom_class')
+        for name, commands in split_commands.items():
+            self.process_css_for_table(td_element, commands, {},
+                                       start_col=start_col,
+                                       start_row=0,
+                                       end_col=end_col,
+                                       end_row=0,
+                                       style_tag_name='overflow_%s_style' % name,
+                                       class_tag_name='overflow_%s_class' % name)
+
     def get_doc_type(self):
         entity_string = ''
         for entity in self.entities:
@@ -1387,13 +1611,19 @@ class ReportXML(object):
             col_span = held_cell_data['colspan']
             avail_width = sum(widths[index:index + col_span])
 
-            if isinstance(display_object, EnhancedParagraph):
-                return display_object.calc_text_height(avail_width=avail_width)
-            elif isinstance(display_object, Table):
-                _, h = display_object.wrap(0, 0)
-                return h
-            else:
-                return 5 * mm
+            # the cell is only measured once for each width however many cells overflow against it
+            heights = held_cell_data['heights']
+            height = heights.get(avail_width)
+            if height is None:
+                if isinstance(display_object, EnhancedParagraph):
+                    # kept on the paragraph too, so the table doesn't measure it again at the same width
+                    height = display_object.estimate_height(avail_width)
+                elif isinstance(display_object, Table):
+                    _, height = display_object.wrap(0, 0)
+                else:
+                    height = 5 * mm
+                heights[avail_width] = height
+            return height
         else:
             return float(raw_overflow_gt_height) * mm
 
@@ -1401,17 +1631,13 @@ class ReportXML(object):
                                 col_widths, table_width, col_span,
                                 styles, offset, col_count, row_count, row_span, row_data, overflow_rows,
                                 rows_variables, held_cells):
-        widths = self.process_column_widths(col_widths, table_width)
+        widths = col_widths.resolve(table_width, self.process_column_widths)
         overflow_gt_height = self.get_overflow_overflow_gt_height(raw_overflow_gt_height=overflow_gt_height,
                                                                   held_cells=held_cells,
                                                                   widths=widths)
 
         avail_width = sum(widths[index:index+col_span])
-        display_object = EnhancedParagraph(xml, style, css_classes=self.styles)
-        height = display_object.calc_text_height(avail_width=avail_width)
-
-        if height <= overflow_gt_height:
-            return display_object, 0
+        cell_xml = xml
 
         if not isinstance(xml, bytes):
             xml = xml.encode()
@@ -1419,33 +1645,51 @@ class ReportXML(object):
         xml, overflow_rows_xml, raw_parts, held_working_tags, alt_method = self.split_cell(
             xml=xml, overflow_length=0, overflow_size=overflow_gt_height)
 
+        # the rows are measured one at a time until they no longer fit, so only the rows before the break are broken
+        # into lines rather than the whole cell
         working_height = 0
-        working_xml = b''
+        working_parts = []
         found_break = False
         overflow_row_offset = 0
         for overflow_row_offset, (row_xml, raw_part, working_tags) in\
                 enumerate(zip([xml] + overflow_rows_xml, raw_parts, held_working_tags), 1):
             if not alt_method:
-                working_xml += raw_part + '<br/>'.encode('utf_8')
+                working_parts += [raw_part, b'<br/>']
                 if raw_part == b'\n':
                     row_xml = row_xml.replace(b'\n', b'M')
             else:
-                working_xml += row_xml
-                
+                working_parts.append(row_xml)
+
             p = EnhancedParagraph(row_xml, style, css_classes=self.styles)
             height = p.calc_text_height(avail_width=avail_width)
             working_height += height
             if working_height > overflow_gt_height:
                 for tag in reversed(working_tags):
                     if not alt_method:
-                        working_xml += ('</' + tag[0] + '>').encode()
+                        working_parts.append(('</' + tag[0] + '>').encode())
                     found_break = True
                 break
         overflow_len = len(overflow_rows_xml[overflow_row_offset-1:])
         if not found_break or overflow_len == 0:
-            return display_object, 0
+            return EnhancedParagraph(cell_xml, style, css_classes=self.styles), 0
+
+        # the cell only overflows if it's taller than overflow_gt_height as a whole. If the start of the cell is too tall
+        # then so is the whole cell, so twice as many rows are measured each time until they're too tall rather than
+        # measuring every row of a long cell
+        prefix_rows = overflow_row_offset
+        while True:
+            if prefix_rows >= len(raw_parts):
+                cell_object = EnhancedParagraph(cell_xml, style, css_classes=self.styles)
+                if cell_object.calc_text_height(avail_width=avail_width) <= overflow_gt_height:
+                    return cell_object, 0
+                break
+            prefix = EnhancedParagraph(markup_prefix(raw_parts, held_working_tags, prefix_rows, alt_method), style,
+                                       css_classes=self.styles)
+            if prefix.calc_text_height(avail_width=avail_width) > overflow_gt_height:
+                break
+            prefix_rows *= 2
 
-        display_object = EnhancedParagraph(working_xml, style, css_classes=self.styles)
+        display_object = EnhancedParagraph(b''.join(working_parts), style, css_classes=self.styles)
 
         self.process_css_for_table(tag=td_element,
                                    styles=styles,
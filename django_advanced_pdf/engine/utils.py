@@ -9,10 +9,11 @@ from reportlab.lib import colors
 from reportlab.lib.colors import HexColor
 from reportlab.lib.pagesizes import A4, A6, A5, A3, A2, A1, A0, LETTER, LEGAL, ELEVENSEVENTEEN, landscape, portrait
 from reportlab.lib.units import mm
-from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, SimpleDocTemplate, Flowable, Table, TableStyle
 
+from django_advanced_pdf.engine.font_metrics import string_width
+
 logger = logging.getLogger("reportlab.platypus")
 
 GREYFILL_COLOUR = HexColor(0xe3e3e3)
@@ -271,7 +272,7 @@ class DecimalText(object):
                 if self.m_dp == 0:
                     w = 1 * mm
                 else:
-                    w = 1 * mm + stringWidth('.' + '0' * self.m_dp, self.m_style.fontName, self.m_style.fontSize)
+                    w = 1 * mm + string_width('.' + '0' * self.m_dp, self.m_style.fontName, self.m_style.fontSize)
                 self.cachedWidths[key] = w
             return self.cachedWidths[key]
 
@@ -356,6 +357,36 @@ class ColumnWidthPercentage(object):
         return self.value
 
 
+class ColumnWidths(list):
+    """
+    A table's column widths as given in the xml (mm, ColumnWidthPercentage or None for a share of the space left).
+    The absolute widths are worked out once for each table width and kept until one of the widths is changed.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._resolved = {}
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._resolved = {}
+
+    def append(self, value):
+        super().append(value)
+        self._resolved = {}
+
+    def resolve(self, table_width, resolve_func):
+        """
+        @type   resolve_func : callable
+        @param  resolve_func : works out the absolute widths, see ReportXML.process_column_widths
+        @return : list of widths in points (a new list each time)
+        """
+        widths = self._resolved.get(table_width)
+        if widths is None:
+            widths = self._resolved[table_width] = resolve_func(list(self), table_width)
+        return list(widths)
+
+
 class MyTDUserHtmlParser(HTMLParser):
 
     def __init__(self, *args, **kwargs):
@@ -1,3 +1,6 @@
+import copy
+import zlib
+
 from reportlab.lib import colors
 from reportlab.lib.units import mm
 from reportlab.lib.utils import ImageReader
@@ -5,6 +8,12 @@ from reportlab.pdfgen import canvas
 
 from django_advanced_pdf.engine.utils import PageUsed, get_boolean_value
 
+MISSING = object()
+# the parts of the canvas state made afresh for each page (by Canvas._restartAccumulators), which are added to while
+# the page is drawn in save so can't be copied from the page before
+PAGE_ACCUMULATORS = ('_psCommandsAfterPage', '_psCommandsBeforePage', '_formsinuse', '_annotationrefs', '_formData',
+                     '_colorsUsed', '_shadingUsed')
+
 
 class BasePager(canvas.Canvas):
 
@@ -18,7 +27,7 @@ class BasePager(canvas.Canvas):
                  program_name=None,
                  background_image_first=None, background_image_remaining=None,
                  background_image_footer=None, test_mode=False, status_method=None,
-                 root_element=None, **kwargs):
+                 root_element=None, release_memory=False, **kwargs):
 
         self.status_method = status_method
         self.heading = heading
@@ -28,6 +37,8 @@ class BasePager(canvas.Canvas):
         self._saved_page_states = []
         self.test_mode = test_mode
         self.root_element = root_element
+        self.release_memory = release_memory
+        self._last_page_state = None
 
         self.pageused = PageUsed(left=border_left_first,
                                  right=border_right_first,
@@ -57,7 +68,6 @@ class BasePager(canvas.Canvas):
     def add_background_images(self):
         if self.background_image_first is not None or self.background_image_remaining is not None:
             self.draw_first_page_background()
-            self.draw_footer_image_block()
 
     def add_draw_method(self, method):
 
@@ -185,11 +195,13 @@ class BasePager(canvas.Canvas):
         self.setStrokeColor(colors.black)
 
     def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))
+        state = dict(self.__dict__)
+        if self.release_memory:
+            state = self.pack_page_state(state)
+        self._saved_page_states.append(state)
         self._startPage()
 
         self.draw_remaining_page_background()
-        self.draw_footer_image_block()
 
     def save(self):
 
@@ -200,7 +212,9 @@ class BasePager(canvas.Canvas):
 
         num_pages = len(self._saved_page_states)
 
-        for state in self._saved_page_states:
+        state = {}
+        for saved_state in self._saved_page_states:
+            state = self.unpack_page_state(state, saved_state) if self.release_memory else saved_state
             self.__dict__.update(state)
             if self.status_method is not None:
                 self.status_method(f'Processing page {self._pageNumber}/{num_pages}')
@@ -210,27 +224,87 @@ class BasePager(canvas.Canvas):
 
         canvas.Canvas.save(self)
 
-    def draw_background(self, image):
+    def pack_page_state(self, state):
+        """
+        Used when release_memory is set so that the pages held until the page count is known take up as little room as
+        possible. Only the parts of the canvas state that have changed since the last page are kept (values that have
+        just been reset to an equal empty value are recreated from the last page's, apart from the PAGE_ACCUMULATORS)
+        and the page's drawing code is compressed.
+        """
+        del state['_last_page_state']
+        last_state = self._last_page_state
+        self._last_page_state = state
+        code = state.pop('_code')
+        changes = {}
+        copied = []
+        if last_state is None:
+            changes.update(state)
+            removed = ()
+        else:
+            for key, value in state.items():
+                if key in PAGE_ACCUMULATORS:
+                    changes[key] = value
+                    continue
+                last_value = last_state.get(key, MISSING)
+                if last_value is value:
+                    continue
+                if type(last_value) is type(value) and last_value == value:
+                    copied.append(key)
+                else:
+                    changes[key] = value
+            removed = tuple(key for key in last_state if key not in state)
+        state['_code'] = code
+        code = zlib.compress('\n'.join(code).encode('utf-8', 'surrogatepass')) if code else None
+        return changes, tuple(copied), removed, code
+
+    @staticmethod
+    def unpack_page_state(state, packed_state):
+        """
+        Returns the full canvas state for a page packed by pack_page_state, from the state of the page before it.
+        """
+        changes, copied, removed, code = packed_state
+        state = dict(state)
+        for key in removed:
+            del state[key]
+        for key in copied:
+            state[key] = copy.copy(state[key])
+        state.update(changes)
+        state['_code'] = [zlib.decompress(code).decode('utf-8', 'surrogatepass')] if code is not None else []
+        return state
+
+    def draw_image_form(self, name, image, width, height):
+        """
+        Draws an image that's on every page from a form made the first time it's drawn, so the image is only read once
+        and each page just refers to the form.
+        """
+        form_name = 'pager_%s' % name
+        if not self.hasForm(form_name):
+            self.beginForm(form_name, 0, 0, width, height)
+            self.drawImage(ImageReader(image), 0, 0, width, height)
+            self.endForm()
+        self.doForm(form_name)
+
+    def draw_background(self, image, name='background'):
         if image is not None:
-            self.drawImage(ImageReader(image), 0, 0, self.page_width(), self.page_height())
+            self.draw_image_form(name, image, self.page_width(), self.page_height())
 
     def draw_first_page_background(self):
         """
         Adds the first page background image to the printout
         """
-        self.draw_background(self.background_image_first)
+        self.draw_background(self.background_image_first, name='background_first')
 
     def draw_remaining_page_background(self):
         """
         Adds the background image for the remaining pages in the printout
         """
-        self.draw_background(self.background_image_remaining)
+        self.draw_background(self.background_image_remaining, name='background_remaining')
 
     def draw_footer_image_block(self):
         """
-        Adds the footer image to the printout
+        Adds the footer image to the printout (once the pages are laid out, so over the page)
         """
         if self.background_image_footer is not None:
             border_bottom = self.border_bottom(True)
             page_width = self.page_width()
-            self.drawImage(ImageReader(self.background_image_footer), 0, 0, page_width, border_bottom)
+            self.draw_image_form('footer', self.background_image_footer, page_width, border_bottom)
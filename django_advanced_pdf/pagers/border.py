@@ -1,8 +1,8 @@
 from time import strftime, localtime
 
 from reportlab.lib.units import mm
-from reportlab.pdfbase.pdfmetrics import stringWidth
 
+from django_advanced_pdf.engine.font_metrics import string_width
 from django_advanced_pdf.engine.utils import GREYFILL_COLOUR, BLACK_COLOUR
 from django_advanced_pdf.pagers.base import BasePager
 
@@ -45,7 +45,7 @@ class BorderPager(BasePager):
         self.setStrokeColor(GREYFILL_COLOUR)
         self.setFillColor(GREYFILL_COLOUR)
 
-        text_width = stringWidth(self.heading, "Helvetica", 14)
+        text_width = string_width(self.heading, "Helvetica", 14)
         if text_width * mm < 30 * mm:
             text_width = 30 * mm
         box_left = (border_right - 5 * mm) - text_width
@@ -68,9 +68,9 @@ class BorderPager(BasePager):
 
         # page totals
 
-        of_width = stringWidth(" of ", "Helvetica", 12)
-        current_page_width = stringWidth("%d" % self._pageNumber, "Helvetica-Bold", 14)
-        total_page_number_width = stringWidth("%d" % page_count, "Helvetica-Bold", 14)
+        of_width = string_width(" of ", "Helvetica", 12)
+        current_page_width = string_width("%d" % self._pageNumber, "Helvetica-Bold", 14)
+        total_page_number_width = string_width("%d" % page_count, "Helvetica-Bold", 14)
 
         total_width = current_page_width + of_width + total_page_number_width + (2 * mm)
 
@@ -86,7 +86,7 @@ class BorderPager(BasePager):
         self.setFont("Helvetica", 10)
 
         time_str = self.get_time_string()
-        time_width = stringWidth(time_str, "Helvetica", 10) + 4 * mm
+        time_width = string_width(time_str, "Helvetica", 10) + 4 * mm
 
         self.line(border_right - total_width, border_bottom, border_right - total_width, bottom_base)  # mid line
         self.line(border_right - (total_width + time_width), border_bottom,
@@ -1,13 +1,39 @@
+import base64
+import datetime
 import os
 import pathlib
+import pickle
+import re
+import tempfile
+import tracemalloc
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 import fitz
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from lxml import etree
 from reportlab.lib import colors
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import mm
-from reportlab.platypus import TableStyle, Table, Image as RLImage
-
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import TableStyle, Table, Image as RLImage, Paragraph
+
+from django_advanced_pdf.engine.cell_markup import markup_prefix
+from django_advanced_pdf.engine.column_widths import solve_column_widths
+from django_advanced_pdf.engine.enhanced_paragraph.deferred_paragraph import DeferredParagraph
+from django_advanced_pdf.engine.enhanced_paragraph.enhanced_paragraph import EnhancedParagraph
+from django_advanced_pdf.engine.enhanced_table.data import EnhancedTableData
+from django_advanced_pdf.engine.enhanced_table.enhanced_tables import EnhancedTable
+from django_advanced_pdf.engine.enhanced_table.row_variables import MAX_CHAIN_LENGTH, TableVariables
+from django_advanced_pdf.engine.enhanced_table.table_chunks import ChunkedTable, chunk_table
+from django_advanced_pdf.engine.font_metrics import get_font_widths
+from django_advanced_pdf.engine.object_registry import ObjectRegistry
+from django_advanced_pdf.engine.png_images import ImageCache, image_cache
 from django_advanced_pdf.engine.report_xml import ReportXML
+from django_advanced_pdf.engine.utils import ReportXMLError
 from PIL import ImageChops, Image
 
 
@@ -119,6 +145,714 @@ class PDFTests(unittest.TestCase):
     def test_label(self):
         self.run_report(name='label', object_lookup=self.get_sample_objects())
 
+    def test_grid(self):
+        self.run_report(name='grid')
+
+    def test_font_metrics(self):
+        words = ['Hello', 'world,', '£12.50', 'naïve', 'café', '—', 'A' * 40] * 20
+        for font_name in ['Helvetica', 'Times-Bold', 'Courier']:
+            widths = get_font_widths(font_name).token_widths(words, 9.5)
+            self.assertEqual(widths, [stringWidth(word, font_name, 9.5) for word in words])
+
+            style = ParagraphStyle('test', fontName=font_name, fontSize=9)
+            text = ' '.join(words)
+            for avail_width in [40, 150, 400]:
+                enhanced_lines = EnhancedParagraph(text, style).breakLines([avail_width - 10, avail_width]).lines
+                lines = Paragraph(text, style).breakLines([avail_width - 10, avail_width]).lines
+                self.assertEqual([tuple(line) for line in enhanced_lines], [tuple(line) for line in lines])
+
+    def test_incremental_split(self):
+        style = ParagraphStyle('test', fontName='Helvetica', fontSize=9, leading=11, firstLineIndent=20)
+        text = ' '.join(['word%d <b>bold%d</b>' % (i, i) for i in range(2000)])
+
+        def split_lines(paragraph):
+            lines = []
+            while True:
+                paragraph.wrap(300, 500)
+                parts = paragraph.split(300, 500)
+                if len(parts) < 2:
+                    parts[0].wrap(300, 500)
+                    return lines + [parts[0].blPara.lines]
+                parts[0].wrap(300, 500)
+                lines.append(parts[0].blPara.lines)
+                paragraph = parts[1]
+
+        incremental = split_lines(EnhancedParagraph(text, style, incremental_split=True))
+        standard = split_lines(EnhancedParagraph(text, style))
+        self.assertGreater(len(standard), 5)
+        self.assertEqual([[[word.text for word in line.words] for line in page] for page in incremental],
+                         [[[word.text for word in line.words] for line in page] for page in standard])
+
+    def test_split_row_commands(self):
+        def split_tables(index_commands):
+            data = [['Heading', 'Value', '']] + [['Row %d' % row, str(row), ''] for row in range(1, 201)]
+            style = [('GRID', (0, 0), (-1, -1), 0.5, colors.black)]
+            for row in range(1, 201):
+                if row % 3 == 0:
+                    style.append(('BACKGROUND', (0, row), (-1, row), colors.yellow))
+                if row % 7 == 0:
+                    style.append(('SPAN', (1, row), (2, row + 1)))
+                style.append(('LINEBELOW', (0, row), (-1, row), 0.25, colors.blue, 'butt', (1, 2)))
+            table = EnhancedTable({'row_data': data,
+                                   'headers_index': [None for _ in data],
+                                   'footers_index': [None for _ in data]}, style=style, repeat_rows=1, col_widths=[100, 100, 100],
+                                  _index_commands=index_commands)
+            tables = []
+            while True:
+                table.wrap(400, 300)
+                parts = table.split(400, 300)
+                tables.append(parts[0])
+                if len(parts) < 2:
+                    return tables
+                table = parts[-1]
+
+        indexed = split_tables(index_commands=True)
+        standard = split_tables(index_commands=False)
+        self.assertGreater(len(standard), 5)
+        self.assertEqual(len(indexed), len(standard))
+        for indexed_table, table in zip(indexed, standard):
+            for name in ['_linecmds', '_bkgrndcmds', '_spanCmds', '_nosplitCmds']:
+                self.assertEqual([tuple(command) for command in getattr(indexed_table, name)],
+                                 [tuple(command) for command in getattr(table, name)])
+
+    def test_split_report_row_commands(self):
+        # ReportXML sets a table's styles after it's made, so its row commands are indexed when it's first split
+        colours = ['#FFFF00', '#00FFFF']
+        rows = ''.join(f'<tr style="background:{colours[row % 2]}"><td>Row {row}</td><td>{row}</td></tr>'
+                       for row in range(200))
+        table = ReportXML(test_mode=True).process_table(
+            etree.fromstring(f'<table><tr><td>Heading</td><td>Value</td></tr>{rows}</table>'), table_width=180)
+        self.assertEqual(table.get_size_report()['_bkgrndcmds'], 200)
+        table.wrap(500, 400)
+        parts = table.split(500, 400)
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(table.get_size_report()['_bkgrndcmds_indexed'], 200)
+        report = parts[-1].get_size_report()
+        self.assertEqual(report['_bkgrndcmds'], 0)
+        self.assertEqual(report['_bkgrndcmds_indexed'], report['rows'])
+
+    def test_layout_memo(self):
+        data = [['Row %d' % row, str(row)] for row in range(40)]
+        table = EnhancedTable({'row_data': data}, col_widths=[100, 100])
+        width, height = table.wrap(400, 2000)
+        row_heights = table._rowHeights
+        self.assertEqual(table.wrap(400, 3000), (width, height))
+        self.assertIs(table._rowHeights, row_heights)
+
+        table.setStyle(TableStyle([('TOPPADDING', (0, 0), (-1, -1), 10)]))
+        self.assertEqual(table.wrap(400, 3000), (width, height + 40 * 7))
+
+    def test_shared_cell_styles(self):
+        data = [['Row %d' % row, str(row), ''] for row in range(100)]
+        table = EnhancedTable({'row_data': data}, col_widths=[100, 100, 100])
+        table.setStyle(TableStyle([('FONTSIZE', (0, 0), (-1, -1), 8),
+                                   ('TEXTCOLOR', (0, 3), (-1, 3), colors.red),
+                                   ('ALIGN', (1, 5), (1, 5), 'RIGHT')]))
+        report = table.get_size_report()
+        self.assertEqual(report['cells'], 300)
+        self.assertEqual(report['cell_styles'], 3)
+        self.assertEqual(table._cellStyles[3][0].color, colors.red)
+        self.assertEqual(table._cellStyles[4][0].color, 'black')
+        self.assertEqual(table._cellStyles[5][1].alignment, 'RIGHT')
+        self.assertEqual(table._cellStyles[5][0].alignment, 'LEFT')
+        self.assertEqual({style.fontsize for row in table._cellStyles for style in row}, {8})
+
+    def test_row_variables(self):
+        variables = TableVariables(title='Estimate', total=0.0, total__currency='£0.00')
+        rows_variables = []
+        copies = []
+        for row in range(100):
+            row_variables = variables.new_row()
+            variables['total'] += row
+            variables['total__currency'] = '£%.2f' % variables['total']
+            row_variables['total'] = variables['total']
+            row_variables['total__currency'] = variables['total__currency']
+            rows_variables.append(row_variables)
+            copies.append(dict(variables))
+
+        self.assertEqual([dict(row_variables) for row_variables in rows_variables], copies)
+        self.assertTrue(all(len(row_variables.changes) <= 2 for row_variables in rows_variables[1:MAX_CHAIN_LENGTH]))
+        self.assertTrue(all(row_variables.chain_length <= MAX_CHAIN_LENGTH for row_variables in rows_variables))
+        self.assertEqual('%(title)s %(total__currency)s' % rows_variables[70], 'Estimate £2485.00')
+        self.assertEqual(EnhancedTable.merge_variables_into_data([['%(total__currency)s']], rows_variables[9]),
+                         [['£45.00']])
+
+    def test_deferred_cells(self):
+        style = ParagraphStyle('deferred', fontName='Helvetica', fontSize=9, leading=11)
+        text = '<b>Item</b> with a description long enough to run over a couple of lines in a narrow cell'
+        deferred = DeferredParagraph(text, style)
+        self.assertEqual(deferred.wrap(120, 1000), EnhancedParagraph(text, style).wrap(120, 1000))
+        self.assertEqual(list(deferred._sizes), [120])
+        self.assertFalse(hasattr(deferred, 'blPara'))
+
+        rows = ''.join('<tr><td>%d</td><td>Row <b>%d</b> some text that wraps in its column</td></tr>' % (row, row)
+                       for row in range(120))
+        pages = []
+        for deferred_cells in ('0', '1'):
+            xml = ('<document page_size="A4" page_style="blank"><table deferred_cells="%s" layout_widths="20,40" '
+                   'style="inner_grid:0.25,#000000">%s</table></document>' % (deferred_cells, rows))
+            result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                pages.append([page.get_pixmap().samples for page in doc])
+        self.assertGreater(len(pages[0]), 1)
+        self.assertEqual(pages[0], pages[1])
+
+    def test_compiled_header_rows(self):
+        header = EnhancedTableData(row_data=[['Brought forward', '%(total__currency)s']], row_heights=[20])
+        rows = [['Row %d' % row, str(row)] for row in range(6)]
+        variables = [{'total__currency': '£10.00'}] * 3 + [{'total__currency': '£20.00'}] * 3
+        table = EnhancedTable({'row_data': rows, 'row_variables': variables, 'headers_index': [None] * 6,
+                               'footers_index': [None] * 6}, headers=[header], col_widths=[100, 100])
+
+        first, first_styles = table._get_continuation_rows(header, 0)
+        second, second_styles = table._get_continuation_rows(header, 2)
+        third, _ = table._get_continuation_rows(header, 3)
+        self.assertEqual(first, [['Brought forward', '£10.00']])
+        self.assertEqual(third, [['Brought forward', '£20.00']])
+        self.assertEqual(header.get_compiled_rows().names, ('total__currency',))
+        self.assertIsNot(first[0], second[0])
+        self.assertIsNot(first_styles[0], second_styles[0])
+        self.assertIs(first_styles[0][0], second_styles[0][0])
+
+    def test_nested_table_cache(self):
+        class UncachedReportXML(ReportXML):
+            def process_nested_table(self, table, table_width):
+                return self.process_table(table, table_width)
+
+        options = ''.join('<tr><td><b>Option %d</b></td><td>Included</td></tr>' % option for option in range(3))
+        rows = ''.join('<tr><td>Line %d</td><td><table style="inner_grid:0.25,#999999">%s</table></td></tr>' %
+                       (row, options) for row in range(40))
+        xml = ('<document page_size="A4" page_style="blank"><table layout_widths="40,100" '
+               'style="inner_grid:0.25,#000000">%s</table></document>' % rows)
+        pages = []
+        for report_class in (UncachedReportXML, ReportXML):
+            report_xml = report_class(test_mode=True)
+            result = report_xml.load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                pages.append([page.get_pixmap().samples for page in doc])
+        self.assertEqual(len(report_xml.nested_tables), 1)
+        self.assertGreater(len(pages[0]), 1)
+        self.assertEqual(pages[0], pages[1])
+
+    def test_table_schema(self):
+        xml = etree.fromstring('<table><tr><td><table><tr><td>A</td><td>B</td></tr></table></td><td>Price</td>'
+                               '<td hidden_column="1">Cost</td></tr>'
+                               '<tr><td>Item</td><td width="30">1.00</td><td>0.50</td></tr></table>')
+        table = ReportXML(test_mode=True).process_table(xml, table_width=150)
+        self.assertEqual([round(width / mm, 6) for width in table._argW], [120, 30])
+        # the nested table is made to fit the width its column ends up with, less the cell's padding
+        nested_table = table._cellvalues[0][0]
+        self.assertEqual([round(width / mm, 6) for width in nested_table._argW], [58, 58])
+
+    def test_auto_column_widths(self):
+        self.assertEqual(solve_column_widths([10, 20], [20, 60], 160), [40, 120])
+        self.assertEqual(solve_column_widths([10, 20], [20, 60], 50), [14, 36])
+        self.assertEqual(solve_column_widths([30, 50], [40, 100], 40), [15, 25])
+
+        rows = ''.join('<tr><td>%d</td><td>Widget %d with a <b>long</b> description that will have to wrap in the '
+                       'table</td><td>£1,234.00</td><td>Yes</td></tr>' % (row, row) for row in range(300))
+        xml = etree.fromstring('<table layout_widths="auto"><tr><td>Code</td><td>Description</td><td>Price</td>'
+                               '<td width="15">Stock</td></tr>%s</table>' % rows)
+        table = ReportXML(test_mode=True).process_table(xml, table_width=180)
+        widths = [width / mm for width in table._argW]
+        self.assertAlmostEqual(sum(widths), 180)
+        self.assertAlmostEqual(widths[3], 15)
+        self.assertEqual(max(widths), widths[1])
+        # the other columns are wide enough for their longest line
+        self.assertGreater(widths[2] * mm, stringWidth('£1,234.00', 'Helvetica', 10) + 12)
+
+    def test_estimate_height(self):
+        style = ParagraphStyle('estimate', fontName='Helvetica', fontSize=9, leading=11)
+        texts = ['Short', 'A few words that will run over more than one line in a narrow column of a table',
+                 'Mixed <b>bold</b> text that is measured by wrapping it', '']
+        for text in texts:
+            for width in (40, 90, 200, 400):
+                paragraph = EnhancedParagraph(text, style)
+                self.assertEqual(paragraph.estimate_height(width), EnhancedParagraph(text, style).wrap(width, 1000)[1])
+                self.assertIn(width, paragraph._estimated_heights)
+        paragraph = EnhancedParagraph(texts[1], style)
+        self.assertEqual(paragraph.estimate_height(200), 22)
+        self.assertFalse(hasattr(paragraph, 'blPara'))
+
+    def test_chunked_table(self):
+        table = EnhancedTable({'row_data': [['Row %d' % row, ''] for row in range(20)],
+                               'headers_index': [None] * 20, 'footers_index': [None] * 20},
+                              style=[('SPAN', (0, 4), (1, 6)), ('BOX', (0, 0), (-1, -1), 0.5, colors.black)],
+                              col_widths=[100, 100])
+        chunked = chunk_table(table, 5)
+        self.assertIsInstance(chunked, ChunkedTable)
+        self.assertEqual([len(chunk.row_data) for chunk in chunked.chunks], [5, 5, 3])
+        self.assertEqual(chunked.table._nrows, 7)
+        self.assertIs(chunk_table(table, 0), table)
+
+        # the reports split at the same rows (and so look the same) however few rows are in each chunk
+        for name in ('keep_with_next', 'change_header', 'estimate'):
+            with open(Path(self.get_test_folder(), 'reports', f'{name}.xml')) as f:
+                xml = f.read()
+            pages = []
+            for chunk_rows in ('0', '3', '7'):
+                result = ReportXML(test_mode=True).load_xml_and_make_pdf(
+                    xml=re.sub(r'<table\b', f'<table chunk_rows="{chunk_rows}"', xml))
+                with fitz.open("pdf", result) as doc:
+                    pages.append([page.get_pixmap().samples for page in doc])
+            self.assertEqual(pages[0], pages[1], msg=name)
+            self.assertEqual(pages[0], pages[2], msg=name)
+
+    def test_release_memory(self):
+        def render(pages, release_memory):
+            # memory held once the pages are laid out and waiting for the page count
+            xml = '<document page_size="A4" page_style="blank">%s</document>' % ''.join(
+                f'<p>Page {page} of the notes</p><page_break/>' for page in range(pages))
+            held = []
+
+            def status_method(message):
+                if message.startswith('Processing page 1/'):
+                    held.append(tracemalloc.get_traced_memory()[0])
+
+            tracemalloc.start()
+            try:
+                result = ReportXML(test_mode=True, status_method=status_method,
+                                   release_memory=release_memory).load_xml_and_make_pdf(xml=xml)
+            finally:
+                tracemalloc.stop()
+            with fitz.open("pdf", result) as doc:
+                return held[0], [page.get_text() for page in doc]
+
+        render(10, False)
+        growth = {}
+        for release_memory in (False, True):
+            held_100, text_100 = render(100, release_memory)
+            held_1000, text_1000 = render(1000, release_memory)
+            self.assertEqual(len(text_1000), 1000)
+            growth[release_memory] = (held_1000 - held_100) / 900
+            if release_memory:
+                self.assertEqual(text_1000, pages_text)
+            pages_text = text_1000
+        self.assertLess(growth[True], 1500)
+        self.assertLess(growth[True], growth[False] / 2)
+
+    def test_release_memory_images(self):
+        pagers = []
+
+        class RecordingReportXML(ReportXML):
+            def canvasmaker(self, *args, **kwargs):
+                pagers.append(super().canvasmaker(*args, **kwargs))
+                return pagers[-1]
+
+        xml = '<document page_size="A4" page_style="blank">%s</document>' % ''.join(
+            f'<p>Page {page}</p><page_break/>' for page in range(8))
+        results = []
+        forms = []
+        for release_memory in (False, True):
+            images = {}
+            for name, colour in (('remaining', (0, 255, 0)), ('footer', (0, 0, 255))):
+                images[name] = BytesIO()
+                Image.new('RGB', (60, 60), colour).save(images[name], 'PNG')
+                images[name].seek(0)
+            # the forms each page uses as it's drawn in save
+            page_forms = []
+
+            def status_method(message):
+                if message.startswith('Processing page'):
+                    page_forms.append(list(pagers[-1]._formsinuse))
+
+            report_xml = RecordingReportXML(test_mode=True, release_memory=release_memory,
+                                            status_method=status_method)
+            result = report_xml.load_xml_and_make_pdf(xml=xml, background_image_remaining=images['remaining'],
+                                                      background_image_footer=images['footer'])
+            results.append(re.sub(rb'/ID\s*\[<\w+><\w+>\]', b'', result.getvalue()))
+            forms.append(page_forms)
+        self.assertEqual(len(forms[0]), 8)
+        self.assertEqual(forms[0], forms[1])
+        self.assertEqual(results[0], results[1])
+
+    def test_split_cell(self):
+        notes = ''.join(f'<b>Note {note}</b> follow up<br/>' for note in range(3))
+        first, rows, raw_parts, held_tags, by_length = ReportXML.split_cell(
+            f'<td><font size="9">{notes}</font></td>'.encode(), 5, 5)
+        self.assertFalse(by_length)
+        self.assertEqual(first, b'<td><font size="9"><b>Note 0</b> follow up</font></td>')
+        self.assertEqual(rows[0], b'<td><font size="9"><b>Note 1</b> follow up</font></td>')
+        self.assertEqual(held_tags[0], [('td', '<td>'), ('font', '<font size="9">')])
+        self.assertEqual(len(rows), 3)
+
+        first, rows, raw_parts, held_tags, by_length = ReportXML.split_cell(
+            b'<td><i>one two three four</i> 1 < 2</td>', 0, 12)
+        self.assertTrue(by_length)
+        self.assertEqual(first, b'<td><i>one </i></td>')
+        self.assertEqual(b''.join(raw_parts), b'<td><i>one two three four</i> 1 < 2</td>')
+
+    def test_markup_prefix(self):
+        _, _, raw_parts, held_tags, by_length = ReportXML.split_cell(
+            b'<td><b>one<br/>two<br/>three</b></td>', 0, 5)
+        self.assertEqual(markup_prefix(raw_parts, held_tags, 2, by_length), b'<td><b>one<br/>two</b></td>')
+        self.assertEqual(markup_prefix(raw_parts, held_tags, 3, by_length), b'<td><b>one<br/>two<br/>three</b></td>')
+
+        _, _, raw_parts, held_tags, by_length = ReportXML.split_cell(b'<td><b>one two three</b></td>', 0, 12)
+        self.assertEqual(markup_prefix(raw_parts, held_tags, 1, by_length), b'<td><b>one </b></td>')
+        self.assertEqual(markup_prefix(raw_parts, held_tags, len(raw_parts), by_length),
+                         b'<td><b>one two three</b></td>')
+
+    def test_held_cell_heights(self):
+        style = ParagraphStyle('held', fontName='Helvetica', fontSize=9, leading=11)
+        paragraph = EnhancedParagraph(' '.join(['A description that runs over several lines'] * 10), style)
+        held_cells = {'description': {'display_object': paragraph, 'index': 1, 'colspan': 2, 'heights': {}}}
+        height = ReportXML.get_overflow_overflow_gt_height('#description', held_cells, [50, 100, 60, 30])
+        self.assertEqual(height, EnhancedParagraph(paragraph.text, style).calc_text_height(160))
+        self.assertEqual(held_cells['description']['heights'], {160: height})
+        self.assertEqual(paragraph._estimated_heights[160], height)
+
+        # later cells overflowing against it use the height already measured
+        held_cells['description']['heights'][160] = 123
+        self.assertEqual(ReportXML.get_overflow_overflow_gt_height('#description', held_cells, [50, 100, 60, 30]), 123)
+
+    def test_image_cache(self):
+        def png_data(colour, size=(40, 20)):
+            data = BytesIO()
+            Image.new('RGB', size, colour).save(data, 'PNG')
+            return data.getvalue()
+
+        red, green, blue = png_data((255, 0, 0)), png_data((0, 255, 0)), png_data((0, 0, 255))
+        # room for two of the images
+        cache = ImageCache(max_bytes=2 * (max(len(red), len(green), len(blue)) + 40 * 20 * 3))
+        reader = cache.get_reader(red)
+        self.assertIs(cache.get_reader(red), reader)
+        self.assertIsNot(cache.get_reader(green), reader)
+        self.assertIs(cache.get_reader(red), reader)
+        # adding a third image drops the least recently used one
+        cache.get_reader(blue)
+        self.assertIs(cache.get_reader(red), reader)
+        self.assertEqual(len(cache._readers), 2)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertEqual(cache.get_reader(png_data((255, 255, 255), size=(400, 400))).getSize(), (400, 400))
+        self.assertEqual(len(cache._readers), 2)
+
+        # an image used on every line is embedded once
+        rows = ''.join(f'<tr><td><png width="{10 + row}">{base64.b64encode(data).decode()}</png></td></tr>'
+                       for row, data in enumerate([red, green] * 10))
+        result = ReportXML(test_mode=True).load_xml_and_make_pdf(
+            xml=f'<document page_size="A4" page_style="blank"><table>{rows}</table></document>')
+        with fitz.open("pdf", result) as doc:
+            self.assertEqual(len(doc[0].get_images()), 2)
+            self.assertEqual(len(doc[0].get_image_info()), 20)
+
+    def test_image_cache_threads(self):
+        # renders on several threads share the cached image
+        noise = Image.merge('RGB', [Image.effect_noise((700, 700), 60) for _ in range(3)])
+        image_data = BytesIO()
+        noise.save(image_data, 'PNG')
+        image_data = base64.b64encode(image_data.getvalue()).decode('ascii')
+        xml = f'<document page_size="A4"><table><tr><td><png width="100">{image_data}</png></td></tr></table></document>'
+
+        def render(_):
+            result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                return doc[0].get_pixmap().samples
+
+        for _ in range(2):
+            image_cache.clear()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                pages = list(executor.map(render, range(8)))
+            self.assertEqual(len(set(pages)), 1)
+
+    def test_max_dpi(self):
+        photo = Image.merge('RGB', [Image.effect_noise((1200, 900), sigma) for sigma in (40, 60, 80)])
+        logo = Image.new('RGBA', (1200, 900), (0, 0, 0, 0))
+        logo.paste((200, 0, 0, 255), (100, 100, 1100, 800))
+        images = []
+        for image in (photo, logo):
+            data = BytesIO()
+            image.save(data, 'PNG')
+            images.append(base64.b64encode(data.getvalue()).decode())
+
+        def render(document_attrs, png_attrs):
+            rows = ''.join(f'<tr><td><png width="30"{png_attrs}>{image}</png></td></tr>' for image in images)
+            result = ReportXML(test_mode=True).load_xml_and_make_pdf(
+                xml=f'<document page_size="A4" page_style="blank"{document_attrs}><table>{rows}</table></document>')
+            with fitz.open("pdf", result) as doc:
+                # (width, height, whether it has a transparency mask, filters) of the photo then the logo
+                return sorted([(width, height, smask != 0, doc.xref_get_key(xref, 'Filter')[1])
+                               for xref, smask, width, height, *_ in doc[0].get_images()], key=lambda image: image[2])
+
+        self.assertEqual([image[:3] for image in render('', '')], [(1200, 900, False), (1200, 900, True)])
+        # 30mm at 200dpi is 237 pixels, the photo is saved as a JPEG and the logo keeps its transparency
+        scaled = render(' max_dpi="200"', '')
+        self.assertEqual([image[:3] for image in scaled], [(237, 178, False), (237, 178, True)])
+        self.assertIn('DCTDecode', scaled[0][3])
+        self.assertNotIn('DCTDecode', scaled[1][3])
+        self.assertEqual(render(' max_dpi="600"', ' max_dpi="200"'), scaled)
+        self.assertEqual([image[:3] for image in render('', ' max_dpi="2000"')],
+                         [(1200, 900, False), (1200, 900, True)])
+
+    def test_image_src(self):
+        def png_data(colour):
+            data = BytesIO()
+            Image.new('RGB', (40, 20), colour).save(data, 'PNG')
+            return data.getvalue()
+
+        class TestStorage(Storage):
+            def __init__(self):
+                self.files = {}
+                self.reads = 0
+
+            def _open(self, name, mode='rb'):
+                self.reads += 1
+                return ContentFile(self.files[name][0])
+
+            def get_modified_time(self, name):
+                return self.files[name][1]
+
+        storage = TestStorage()
+        storage.files['products/red.png'] = png_data((255, 0, 0)), datetime.datetime(2024, 1, 1)
+        with tempfile.TemporaryDirectory() as folder:
+            Path(folder, 'products').mkdir()
+            Path(folder, 'products', 'green.png').write_bytes(png_data((0, 255, 0)))
+            xml = ('<document page_size="A4" page_style="blank"><table>'
+                   '<tr><td><png src="storage:products/red.png" width="20"/></td>'
+                   '<td><png src="file:products/green.png" width="20"/></td></tr></table></document>')
+
+            def render():
+                result = ReportXML(test_mode=True, image_storage=storage,
+                                   image_root=folder).load_xml_and_make_pdf(xml=xml)
+                with fitz.open("pdf", result) as doc:
+                    pixmap = doc[0].get_pixmap()
+                    return pixmap.pixel(30, 15), pixmap.pixel(330, 15)
+
+            self.assertEqual(render(), ((255, 0, 0), (0, 255, 0)))
+            self.assertEqual(render(), ((255, 0, 0), (0, 255, 0)))
+            self.assertEqual(storage.reads, 1)
+            # changed files are read again
+            storage.files['products/red.png'] = png_data((0, 0, 255)), datetime.datetime(2024, 1, 2)
+            Path(folder, 'products', 'green.png').write_bytes(png_data((255, 255, 0)))
+            os.utime(Path(folder, 'products', 'green.png'), ns=(0, 10 ** 9))
+            self.assertEqual(render(), ((0, 0, 255), (255, 255, 0)))
+            self.assertEqual(storage.reads, 2)
+
+            for src in ('file:../green.png', 'ftp:green.png'):
+                with self.assertRaises(ReportXMLError):
+                    ReportXML(test_mode=True, image_root=folder).load_xml_and_make_pdf(
+                        xml=f'<document page_size="A4"><table><tr><td><png src="{src}"/></td></tr></table></document>')
+
+    def test_background_image_forms(self):
+        images = {}
+        for name, colour in (('first', (255, 0, 0)), ('remaining', (0, 255, 0)), ('footer', (0, 0, 255))):
+            images[name] = BytesIO()
+            Image.new('RGB', (60, 60), colour).save(images[name], 'PNG')
+            images[name].seek(0)
+        xml = ('<document page_size="A4" page_style="blank" border_bottom_first="20" border_top_first="20">%s'
+               '</document>' % ''.join(f'<p>Paragraph {row}</p>' for row in range(300)))
+        result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml,
+                                                                 background_image_first=images['first'],
+                                                                 background_image_remaining=images['remaining'],
+                                                                 background_image_footer=images['footer'])
+        with fitz.open("pdf", result) as doc:
+            self.assertGreater(len(doc), 3)
+            # each image is embedded once and drawn on each page from a form
+            self.assertEqual(sum(doc.xref_get_key(xref, 'Subtype')[1] == '/Image'
+                                 for xref in range(1, doc.xref_length())), 3)
+            self.assertEqual([sorted(name for _, name, *_ in doc[page].get_xobjects()) for page in (0, 1)],
+                             [['FormXob.pager_background_first', 'FormXob.pager_footer'],
+                              ['FormXob.pager_background_remaining', 'FormXob.pager_footer']])
+            colours = [(page.get_pixmap().pixel(300, 20), page.get_pixmap().pixel(300, 830)) for page in doc]
+        self.assertEqual(colours[0], ((255, 0, 0), (0, 0, 255)))
+        self.assertEqual(set(colours[1:]), {((0, 255, 0), (0, 0, 255))})
+
+    def test_image_workers(self):
+        with open(Path(self.get_test_folder(), 'reports', 'basic.xml')) as f:
+            xml = f.read()
+        pages = []
+        for image_workers in (0, 3):
+            report_xml = ReportXML(test_mode=True, image_workers=image_workers)
+            result = report_xml.load_xml_and_make_pdf(xml=xml)
+            self.assertEqual(report_xml.image_futures, {})
+            with fitz.open("pdf", result) as doc:
+                pages.append([page.get_pixmap().samples for page in doc])
+        self.assertEqual(pages[0], pages[1])
+
+        # one image downsampled to several sizes by different workers at once
+        noise = Image.merge('RGB', [Image.effect_noise((1200, 900), 60) for _ in range(3)])
+        image_data = BytesIO()
+        noise.save(image_data, 'PNG')
+        image_data = base64.b64encode(image_data.getvalue()).decode('ascii')
+        rows = ''.join(f'<tr><td><png width="{20 + cell * 5}">{image_data}</png></td></tr>' for cell in range(16))
+        xml = f'<document page_size="A4" max_dpi="150"><table>{rows}</table></document>'
+        pages = []
+        for image_workers in (0, 8):
+            image_cache.clear()
+            result = ReportXML(test_mode=True, image_workers=image_workers).load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                pages.append([page.get_pixmap().samples for page in doc])
+        self.assertEqual(pages[0], pages[1])
+
+        # only the images in cells that are shown are made
+        xml = ('<document page_size="A4"><table>'
+               '<tr><td><png src="file:shown.png"/></td><td hidden="1"><png src="file:cell.png"/></td></tr>'
+               '<tr hidden="1"><td><png src="file:row.png"/></td></tr>'
+               '<tr><td show_column="0"><png src="file:column.png"/></td></tr>'
+               '</table><table hidden="1"><tr><td><png src="file:table.png"/></td></tr></table></document>')
+        report_xml = ReportXML(test_mode=True, image_workers=2)
+        report_xml.prefetch_images(etree.fromstring(xml)).shutdown()
+        self.assertEqual([element.get('src') for element in report_xml.image_futures], ['file:shown.png'])
+
+        # errors making an image are raised where the image is used
+        with self.assertRaises(ReportXMLError):
+            ReportXML(test_mode=True, image_workers=2).load_xml_and_make_pdf(
+                xml='<document page_size="A4"><table><tr><td><png src="ftp:logo.png"/></td></tr></table></document>')
+
+    def test_object_registry(self):
+        built = []
+
+        def build_notes():
+            built.append('notes')
+            return Paragraph('Registered notes', ParagraphStyle('notes'))
+
+        registry = ObjectRegistry()
+        registry.register('notes', builder=build_notes, wrap=(100 * mm, 100 * mm))
+        registry.register('unused', builder=lambda: built.append('unused'))
+        with self.assertRaises(TypeError):
+            registry.register('text', 'not a flowable')
+        with self.assertRaises(ValueError):
+            registry.register('notes')
+        self.assertIn('notes', registry)
+        self.assertEqual(built, [])
+
+        xml = '<document page_size="A4"><obj id="notes"/><obj id="notes"/></document>'
+        for object_lookup in (registry, lambda object_id: registry.get(object_id)):
+            result = ReportXML(test_mode=True, object_lookup=object_lookup).load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                self.assertEqual(doc[0].get_text().count('Registered notes'), 2)
+        # only the objects used are built, once, and each use gets its own copy
+        self.assertEqual(built, ['notes'])
+        self.assertIsNot(registry['notes'], registry['notes'])
+        calls = []
+        report_xml = ReportXML(object_lookup=lambda object_id: calls.append(object_id) or registry.get(object_id))
+        self.assertIsNot(report_xml.lookup_object('notes'), report_xml.lookup_object('notes'))
+        self.assertEqual(calls, ['notes'])
+        with self.assertRaises(KeyError):
+            registry['missing']
+
+        pickled = base64.urlsafe_b64encode(pickle.dumps(Paragraph('Pickled notes'))).decode('ascii')
+        xml = f'<document page_size="A4"><obj>{pickled}</obj></document>'
+        result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+        with fitz.open("pdf", result) as doc:
+            self.assertIn('Pickled notes', doc[0].get_text())
+        with self.assertRaises(ReportXMLError):
+            ReportXML(test_mode=True, allow_pickled_objects=False).load_xml_and_make_pdf(xml=xml)
+
+    def test_split_in_row(self):
+        notes = '<br/>'.join(f'Note {note} follow up' for note in range(300))
+        xml = f'''<document page_size="A4" page_style="blank">
+                    <style>main {{inner_grid:0.25,#000000; box:0.5,#000000}}</style>
+                    <table class="main">
+                        <tr><td>Notes</td><td>Other</td></tr>
+                        <tr><td overflow_split="yes" overflow_top_style="background:#FF0000"
+                                overflow_middle_style="background:#00FF00" overflow_bottom_style="background:#0000FF">
+                            <i>{notes}</i></td><td>Side</td></tr>
+                        <tr><td>After</td><td>End</td></tr>
+                    </table>
+                  </document>'''
+        result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+        with fitz.open("pdf", result) as doc:
+            self.assertGreater(len(doc), 2)
+            text = ''.join(page.get_text() for page in doc)
+            colours = [page.get_pixmap().pixel(150, 30) for page in doc]
+        self.assertEqual([int(note) for note in re.findall(r'Note (\d+) follow up', text)], list(range(300)))
+        self.assertEqual(text.count('Side'), 1)
+        self.assertEqual(colours[0], (255, 0, 0))
+        self.assertEqual(set(colours[1:-1]), {(0, 255, 0)})
+        self.assertEqual(colours[-1], (0, 0, 255))
+
+    def test_split_in_row_continuation(self):
+        notes = '<br/>'.join(f'Note {note} follow up' for note in range(200))
+        header = '<header><tr><td>Continued</td><td>Header</td></tr></header>'
+        footer = '<footer><tr><td>More</td><td>Footer</td></tr></footer>'
+        for continuation in (header, header + footer):
+            xml = f'''<document page_size="A4" page_style="blank">
+                        <table>{continuation}
+                            <tr><td>Notes</td><td>Other</td></tr>
+                            <tr><td overflow_split="yes">{notes}</td><td>Side</td></tr>
+                            <tr><td>After</td><td>End</td></tr>
+                        </table>
+                      </document>'''
+            result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                pages = [page.get_text() for page in doc]
+            self.assertGreater(len(pages), 2)
+            self.assertEqual([int(note) for note in re.findall(r'Note (\d+) follow up', ''.join(pages))],
+                             list(range(200)))
+            self.assertEqual(['Continued' in page for page in pages], [False] + [True] * (len(pages) - 1))
+            if continuation != header:
+                self.assertEqual(['More' in page for page in pages], [True] * (len(pages) - 1) + [False])
+
+    def test_split_in_row_draw_twice(self):
+        notes = '<br/>'.join(f'Note {note}' for note in range(60))
+        table = ReportXML(test_mode=True).process_table(etree.fromstring(
+            f'''<table><tr><td overflow_split="yes" overflow_bottom_style="background:#0000FF">{notes}</td></tr>
+                <tr><td>After</td></tr></table>'''), table_width=180)
+        table.wrap(500, 400)
+        piece = table.split(500, 400)[-1]
+        commands = [tuple(command) for command in piece._bkgrndcmds]
+        result = BytesIO()
+        pdf_canvas = canvas.Canvas(result)
+        # a piece can be drawn more than once (nested tables are reused) and is drawn the same each time
+        for _ in range(2):
+            piece.wrapOn(pdf_canvas, 500, 800)
+            piece.drawOn(pdf_canvas, 0, 0)
+            pdf_canvas.showPage()
+            self.assertEqual([tuple(command) for command in piece._bkgrndcmds], commands)
+        pdf_canvas.save()
+        with fitz.open("pdf", result.getvalue()) as doc:
+            pages = [page.get_pixmap().samples for page in doc]
+            pixmap = doc[0].get_pixmap()
+            self.assertIn((0, 0, 255), {pixmap.pixel(20, y) for y in range(0, pixmap.height, 4)})
+        self.assertEqual(pages[0], pages[1])
+
+    def test_split_at_row_parts(self):
+        data = [['Blank'], ['Row 1'], ['Row 2']]
+        table = EnhancedTable({'row_data': data,
+                               'row_properties': [{'row_type': 'BLANK'}, {}, {}],
+                               'headers_index': [None for _ in data],
+                               'footers_index': [None for _ in data]}, col_widths=[100])
+        # nothing comes before a blank first row
+        self.assertEqual(table._split_at_row(1, None, None, 0, rest=False), [])
+        first, = table._split_at_row(2, None, None, 0, rest=False)
+        self.assertEqual(first._cellvalues, [['Blank'], ['Row 1']])
+        rest, = table._split_at_row(2, None, None, 0, first=False)
+        self.assertEqual(rest._cellvalues, [['Row 2']])
+
+    def test_split_in_last_row(self):
+        notes = '<br/>'.join(f'Note {note} follow up' for note in range(150))
+        xml = f'''<document page_size="A4" page_style="blank">
+                    <table><tr><td overflow_split="yes">{notes}</td></tr></table>
+                  </document>'''
+        result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+        with fitz.open("pdf", result) as doc:
+            self.assertGreater(len(doc), 1)
+            text = ''.join(page.get_text() for page in doc)
+        self.assertEqual([int(note) for note in re.findall(r'Note (\d+) follow up', text)], list(range(150)))
+
+    def test_split_in_row_chunked(self):
+        notes = '<br/>'.join(f'Note {note}' for note in range(90))
+        before = ''.join(f'<tr style="background:#EEEEEE"><td>Before {row}</td><td></td></tr>' for row in range(40))
+        after = ''.join(f'<tr style="background:#EEEEEE"><td>After {row}</td><td></td></tr>' for row in range(60))
+        pages = []
+        for chunk_rows in (0, 40):
+            xml = f'''<document page_size="A4" page_style="blank">
+                        <table chunk_rows="{chunk_rows}">{before}
+                            <tr><td overflow_split="yes" overflow_top_style="background:#FF0000"
+                                    overflow_bottom_style="background:#0000FF">{notes}</td><td>Side</td></tr>{after}
+                        </table>
+                      </document>'''
+            result = ReportXML(test_mode=True).load_xml_and_make_pdf(xml=xml)
+            with fitz.open("pdf", result) as doc:
+                pages.append([page.get_pixmap().samples for page in doc])
+                colours = [{page.get_pixmap().pixel(100, y) for y in range(0, 842, 4)} for page in doc]
+            self.assertIn((255, 0, 0), colours[0])
+            # the middle of the row has no style of its own
+            self.assertNotIn((0, 0, 255), colours[1])
+            self.assertIn((0, 0, 255), colours[2])
+        self.assertEqual(pages[0], pages[1])
+
     @staticmethod
     def get_sample_objects():
         # Define the data for the table
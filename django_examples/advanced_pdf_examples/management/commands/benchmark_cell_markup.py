@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_advanced_pdf.engine.report_xml import ReportXML
+
+
+class Command(BaseCommand):
+    help = ('Times splitting the markup of long notes cells with ReportXML.split_cell, which is there before and '
+            'after cell_markup so the same command can be run against either')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=20000)
+        parser.add_argument('--nested-notes', type=int, default=2000)
+        parser.add_argument('--depth', type=int, default=12)
+        parser.add_argument('--overflow-length', type=int, default=500)
+        parser.add_argument('--runs', type=int, default=5)
+
+    @staticmethod
+    def get_notes(count, line_break=b'<br/>'):
+        # notes of about 100 bytes each
+        return b''.join(b'Note %06d called the customer about the order and said they will follow up with them '
+                        b'next week.%s' % (note, line_break) for note in range(count))
+
+    def handle(self, *args, **options):
+        overflow_length = options['overflow_length']
+        depth = options['depth']
+        cells = {
+            'split at breaks': b'<td>' + self.get_notes(options['notes']) + b'</td>',
+            'split at breaks in %d nested font tags' % depth: (
+                b'<td>' + b'<font size="9">' * depth + self.get_notes(options['nested_notes']) +
+                b'</font>' * depth + b'</td>'),
+            'split by length': b'<td>' + self.get_notes(options['notes'], line_break=b' ') + b'</td>',
+        }
+        for name, xml in cells.items():
+            times = []
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                ReportXML.split_cell(xml, overflow_length, overflow_length)
+                times.append(time.perf_counter() - start)
+            self.stdout.write(f'{name} ({len(xml) // 1024}KB): best of {len(times)} {min(times):.3f}s')
@@ -0,0 +1,37 @@
+import base64
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from django_advanced_pdf.engine.png_images import image_cache
+from django_advanced_pdf.engine.report_xml import ReportXML
+
+
+class Command(BaseCommand):
+    help = 'Times a catalogue of photos rendered with different numbers of image_workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=60)
+        parser.add_argument('--size', type=int, default=800)
+        parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4, 8])
+
+    def handle(self, *args, **options):
+        size = options['size']
+        rows = []
+        for image_number in range(options['images']):
+            image = Image.merge('RGB', [Image.effect_noise((size, size * 3 // 4), sigma)
+                                        for sigma in (20 + image_number % 7, 40, 60)])
+            image_data = BytesIO()
+            image.save(image_data, 'PNG')
+            rows.append(f'<tr><td><png width="40">{base64.b64encode(image_data.getvalue()).decode()}</png></td>'
+                        f'<td>Product {image_number}</td></tr>')
+        xml = f'<document page_size="A4" page_style="blank"><table>{"".join(rows)}</table></document>'
+
+        for workers in options['workers']:
+            # every image is decoded again for each run
+            image_cache.clear()
+            start = time.perf_counter()
+            ReportXML(image_workers=workers).load_xml_and_make_pdf(xml=xml)
+            self.stdout.write(f'{workers} workers: {time.perf_counter() - start:.2f}s')